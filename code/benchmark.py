@@ -0,0 +1,424 @@
+"""Module that benchmarks the stages of the event generation chain.
+
+Run the benchmarks and store the results as JSON:
+
+    python -m benchmark run -o results.json
+
+Compare two result files and flag throughput regressions:
+
+    python -m benchmark compare baseline.json results.json
+
+Check the import time of the modules needed by batch workers:
+
+    python -m benchmark imports
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable
+
+import numpy as np
+
+import constants as const
+import integrate
+import scan
+import utils.alphas
+import utils.analysis
+import utils.histogram
+import utils.shower
+import utils.yoda
+
+S = const.Z_MASS**2
+INTERVAL = scan.INTERVAL
+SEED = 42
+# number of standard deviations the integrated cross section may deviate from
+# the analytic one
+CROSS_SECTION_TOLERANCE = 5.
+
+# A stage takes the number of events and the shower cut-off t0 and returns the
+# callable to be timed, so that any setup is excluded from the measurement.
+Stage = Callable[[int, float], Callable[[], object]]
+
+class StageSkipped(Exception):
+    """Raised by a stage that cannot run in this environment, e.g. without
+    an optional dependency, instead of timing something else."""
+
+def _seed(seed: int = SEED):
+    random.seed(seed)
+    np.random.seed(seed)
+
+def _alphas() -> utils.alphas.AlphaS:
+    return utils.alphas.AlphaS(const.Z_MASS**2, const.QCD_COUPLING_Z_MASS)
+
+def _events(events: int) -> list:
+    return list(integrate.event_generator(events, INTERVAL, S))
+
+def _showered_events(events: int, t0: float) -> list:
+    shower = utils.shower.Shower(_alphas(), t0=t0)
+    showered = _events(events)
+    for event in showered:
+        shower.run(event, S)
+    return showered
+
+def stage_event_generator(events, t0):
+    return lambda: _events(events)
+
+def stage_shower(events, t0):
+    shower = utils.shower.Shower(_alphas(), t0=t0)
+    unshowered = _events(events)
+
+    def work():
+        for event in unshowered:
+            shower.run(event, S)
+
+    return work
+
+def stage_shower_jit(events, t0):
+    # imported here, since it imports numba
+    import utils.shower_jit
+    reason = utils.shower_jit.unsupported(utils.shower.Shower(_alphas(), t0))
+    if reason is not None:
+        raise StageSkipped(reason)
+    shower = utils.shower.Shower(_alphas(), t0=t0, jit=True)
+    # trigger the compilation outside of the measurement
+    for event in _events(1):
+        shower.run(event, S)
+    unshowered = _events(events)
+
+    def work():
+        for event in unshowered:
+            shower.run(event, S)
+
+    return work
+
+def stage_cluster(events, t0):
+    analysis = utils.analysis.Analysis()
+    showered = _showered_events(events, t0)
+
+    def work():
+        for event in showered:
+            analysis.cluster(event)
+
+    return work
+
+def stage_analyze(events, t0):
+    analysis = utils.analysis.Analysis()
+    showered = _showered_events(events, t0)
+
+    def work():
+        for event in showered:
+            analysis.analyze(event, 1.)
+
+    return work
+
+def stage_histo_fill(events, t0):
+    histo = utils.histogram.Histo1D(100, -4.3, -0.3)
+    values = np.random.uniform(-5., 0., events).tolist()
+
+    def work():
+        for value in values:
+            histo.fill(value, 1.)
+
+    return work
+
+def stage_integrate(events, t0):
+    sampler = lambda samples: integrate.quark_scattering_process(
+        samples, INTERVAL
+    )
+    return lambda: integrate.integrate_streaming(
+        lambda samples: scan.diff_cross_section(samples, S),
+        events,
+        sampler,
+        scan.VOLUME_ELEMENT,
+        checkpoints=[]
+    )
+
+def stage_yoda(events, t0):
+    analysis = utils.analysis.Analysis()
+    for event in _showered_events(events, t0):
+        analysis.analyze(event, 1.)
+    file = tempfile.NamedTemporaryFile(suffix=".yoda", delete=False)
+    file.close()
+    analysis.finalize(file.name)
+
+    def work():
+        try:
+            return utils.yoda.data_objects([file.name])
+        finally:
+            os.unlink(file.name)
+
+    return work
+
+def stage_chain(events, t0):
+
+    def work():
+        shower = utils.shower.Shower(_alphas(), t0=t0)
+        analysis = utils.analysis.Analysis()
+        for event in integrate.event_generator(events, INTERVAL, S):
+            shower.run(event, S)
+            analysis.analyze(event, 1.)
+
+    return work
+
+# modules needed by batch workers that only generate and analyse events, their
+# import time budget in seconds and modules they should not pull in
+WORKER_MODULES = [
+    "integrate",
+    "constants",
+    "utils.shower",
+    "utils.analysis",
+    "utils.histogram",
+    "utils.yoda",
+]
+IMPORT_BUDGET = .25
+HEAVY_MODULES = ["matplotlib", "scipy", "numba"]
+
+# stages mapped to whether they depend on the shower cut-off t0
+STAGES: dict[str, tuple[Stage, bool]] = {
+    "event_generator": (stage_event_generator, False),
+    "shower": (stage_shower, True),
+    "shower_jit": (stage_shower_jit, True),
+    "cluster": (stage_cluster, True),
+    "analyze": (stage_analyze, True),
+    "histo_fill": (stage_histo_fill, False),
+    "integrate": (stage_integrate, False),
+    "yoda": (stage_yoda, True),
+    "chain": (stage_chain, True),
+}
+
+def measure(stage: Stage, events: int, t0: float, repeat: int = 3) -> dict:
+    """Times a stage for the given number of events and cut-off. Returns the
+    best wall time of `repeat` runs, the resulting event rate and the peak
+    memory allocated by the timed callable, measured in a separate run. For
+    an integration stage, the integral of that run is reported as well."""
+    times = []
+    for _ in range(repeat):
+        _seed()
+        work = stage(events, t0)
+        start = time.perf_counter()
+        work()
+        times.append(time.perf_counter() - start)
+
+    _seed()
+    work = stage(events, t0)
+    tracemalloc.start()
+    output = work()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = min(times)
+    result = {
+        "events": events,
+        "t0": t0,
+        "time": best,
+        "times": times,
+        "events_per_second": events / best if best > 0 else float("inf"),
+        "peak_memory": peak_memory,
+    }
+    if isinstance(output, integrate.RunningIntegral):
+        result["integral"] = output.summary()
+    return result
+
+def run_benchmarks(
+    stages: list[str],
+    events: list[int],
+    t0s: list[float],
+    repeat: int = 3,
+    verbose: bool = True
+) -> dict:
+    """Runs the benchmarks of all `stages` on a grid of event numbers and
+    cut-offs and returns the results as a JSON-serializable dictionary. For
+    each stage, the results form a scaling curve in the number of events.
+    Stages that cannot run here are listed with the reason in the "skipped"
+    entry of the metadata instead."""
+    results = {}
+    skipped = {}
+    for name in stages:
+        stage, uses_t0 = STAGES[name]
+        results[name] = []
+        try:
+            for t0 in (t0s if uses_t0 else [None]):
+                for num in events:
+                    result = measure(
+                        stage, num, 1. if t0 is None else t0, repeat
+                    )
+                    result["t0"] = t0
+                    results[name].append(result)
+                    if verbose:
+                        print(
+                            "{0:>16} events={1:<8} t0={2!s:<6} {3:10.1f} "
+                            "events/s".format(
+                                name, num, t0, result["events_per_second"]
+                            ),
+                            file=sys.stderr
+                        )
+        except StageSkipped as error:
+            del results[name]
+            skipped[name] = str(error)
+            if verbose:
+                print(
+                    "{0:>16} skipped, since {1}".format(name, error),
+                    file=sys.stderr
+                )
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "seed": SEED,
+            "repeat": repeat,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "skipped": skipped,
+        },
+        "results": results,
+    }
+
+def measure_imports(modules: list[str], repeat: int = 3) -> dict:
+    """Measures the time it takes a fresh interpreter, like a process-pool
+    worker, to import `modules`, taking the best of `repeat` processes.
+    Also reports which of the `HEAVY_MODULES` got imported on the way."""
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "import {0}\n"
+        "print(json.dumps([time.perf_counter() - start, "
+        "[m for m in {1!r} if m in sys.modules]]))"
+    ).format(", ".join(modules), HEAVY_MODULES)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [os.path.dirname(__file__), env.get("PYTHONPATH")])
+    )
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code],
+                                env=env,
+                                capture_output=True,
+                                text=True,
+                                check=True).stdout
+        elapsed, heavy = json.loads(output)
+        times.append(elapsed)
+    return {"modules": modules, "time": min(times), "heavy_modules": heavy}
+
+def check_cross_section(integral: dict):
+    """Raises a ValueError if the cross section of an integration stage, as
+    reported by `measure`, deviates from the analytic one by more than
+    `CROSS_SECTION_TOLERANCE` standard deviations, so that a faster but wrong
+    integrand does not pass as an improvement."""
+    expected = scan.total_cross_section(S)
+    deviation = abs(integral["estimate"] - expected)
+    if not deviation <= CROSS_SECTION_TOLERANCE * integral["error"]:
+        raise ValueError(
+            "Cross section {0:.6g} +- {1:.2g} pb does not match the analytic "
+            "{2:.6g} pb.".format(
+                integral["estimate"], integral["error"], expected
+            )
+        )
+
+def compare_results(baseline: dict, current: dict, threshold: float) -> list:
+    """Compares the event rates of two benchmark result dictionaries. Returns
+    a list of (stage, events, t0, ratio) for every measurement whose rate
+    dropped by more than the relative `threshold` w.r.t. the baseline. The
+    cross sections of the integration stages are checked with
+    `check_cross_section`."""
+    regressions = []
+    for name, entries in current["results"].items():
+        for entry in entries:
+            if "integral" in entry:
+                check_cross_section(entry["integral"])
+        reference = {
+            (entry["events"], entry["t0"]): entry
+            for entry in baseline["results"].get(name, [])
+        }
+        for entry in entries:
+            base = reference.get((entry["events"], entry["t0"]))
+            if base is None:
+                continue
+            ratio = entry["events_per_second"] / base["events_per_second"]
+            if ratio < 1. - threshold:
+                regressions.append((name, entry["events"], entry["t0"], ratio))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the benchmarks")
+    run.add_argument("-o", "--output", help="JSON file to write results to")
+    run.add_argument(
+        "--stages", nargs="+", default=list(STAGES), choices=list(STAGES)
+    )
+    run.add_argument(
+        "--events", nargs="+", type=int, default=[100, 300, 1000]
+    )
+    run.add_argument("--t0", nargs="+", type=float, default=[1., 4.])
+    run.add_argument("--repeat", type=int, default=3)
+
+    compare = commands.add_parser("compare", help="compare two result files")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument(
+        "--threshold",
+        type=float,
+        default=.1,
+        help="relative drop of events/s counted as regression"
+    )
+
+    imports = commands.add_parser(
+        "imports", help="check the import time of the worker modules"
+    )
+    imports.add_argument("--modules", nargs="+", default=WORKER_MODULES)
+    imports.add_argument(
+        "--budget",
+        type=float,
+        default=IMPORT_BUDGET,
+        help="maximum import time in seconds"
+    )
+
+    args = parser.parse_args(argv)
+    if args.command == "imports":
+        result = measure_imports(args.modules)
+        print(
+            "Import time {0:.3f}s (budget {1:.3f}s), heavy modules: {2}".format(
+                result["time"], args.budget, result["heavy_modules"] or "none"
+            )
+        )
+        return 0 if result["time"] <= args.budget and \
+            not result["heavy_modules"] else 1
+    if args.command == "run":
+        results = run_benchmarks(args.stages, args.events, args.t0, args.repeat)
+        output = json.dumps(results, indent=2)
+        if args.output is None:
+            print(output)
+        else:
+            with open(args.output, "w") as file:
+                file.write(output)
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+    try:
+        regressions = compare_results(baseline, current, args.threshold)
+    except ValueError as error:
+        print("FAILED {0}".format(error))
+        return 1
+    for name, events, t0, ratio in regressions:
+        print(
+            "REGRESSION {0} events={1} t0={2}: {3:.2f}x baseline events/s".
+            format(name, events, t0, ratio)
+        )
+    if not regressions:
+        print("No regressions above {0:.0%}.".format(args.threshold))
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,8 +3,6 @@
 #
 # Date: 25.08.2022
 
-import scipy.constants as const
-
 import numpy as np
 from numpy.typing import NDArray, ArrayLike
 
@@ -38,12 +36,15 @@ def quark_info(flavors: NDArray[np.int16] | ArrayLike) -> NDArray[np.float64]:
     )
 
 def __getattr__(name: str):
-    return getattr(const, name)
+    # scipy.constants is only imported on first use, since it dominates the
+    # import time of this module
+    import scipy.constants
+    return getattr(scipy.constants, name)
 
 def scattering_mat(flav, s, costheta, _):
     """Scattering matrix element for given flavor and particle outcome."""
     quark_charge, quark_iso_spin = quark_info(flav)
-    prefactor = (4 * const.pi * QED_COUPLING)**2 * NUM_QCD_COLORS
+    prefactor = (4 * np.pi * QED_COUPLING)**2 * NUM_QCD_COLORS
 
     kappa = 1 / 4 / WEINBERG_ANGLE_SQ_SINE / (1 - WEINBERG_ANGLE_SQ_SINE)
     chi_denom = (s - Z_MASS**2)**2 + Z_MASS**2 * Z_DECAY_WIDTH**2
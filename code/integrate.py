@@ -11,12 +11,15 @@ from numpy.typing import NDArray, ArrayLike
 
 import utils.vector
 import utils.particle
+import utils.histogram
 
 IntegrableFunction = Callable[[NDArray[np.float64]], np.float64]
 IntegrationInterval = NDArray[np.float64] | ArrayLike
 IntegrationParameters = NDArray[np.int16] | ArrayLike
 
 Sampler = Callable[[int], NDArray[np.float64]]
+Observable = Callable[[NDArray[np.float64]],
+                      NDArray[np.float64] | tuple[NDArray[np.float64], ...]]
 
 def uniform_sampler(samples: int, interval: IntegrationInterval):
     """Generate an array of uniformly distributed samples."""
@@ -128,3 +131,222 @@ def integrate_sampler(
         )
 
     return np.mean(res), np.std(res)
+
+def log_checkpoints(
+    max_samples: int, num: int = 100, min_samples: int = 10
+) -> NDArray[np.int64]:
+    """Generate unique log-spaced sample counts up to `max_samples`."""
+    return np.unique(
+        np.logspace(
+            np.log10(min_samples), np.log10(max_samples), num=num
+        ).astype(np.int64)
+    )
+
+class RunningIntegral:
+    """Online accumulator of a MC integral, that is fed function samples chunk
+    by chunk and records the estimate, its error and the weight distribution
+    at the given sample count `checkpoints` during a single streaming pass."""
+
+    def __init__(
+        self,
+        volume_element: float,
+        checkpoints: Iterable[int] | None = None
+    ):
+        self.volume_element = volume_element
+        self.checkpoints = sorted(checkpoints) if checkpoints is not None else []
+        self.history: list[dict[str, float]] = []
+        self.samples = 0
+        self.mean = 0.
+        self.sum_sq_dev = 0.
+        self.sum_weights = 0.
+        self.sum_weights_sq = 0.
+        self.max_weight = -np.inf
+        self._next_checkpoint = 0
+
+    @property
+    def estimate(self) -> float:
+        return self.volume_element * self.mean
+
+    @property
+    def error(self) -> float:
+        """Statistical error of the estimate."""
+        if self.samples < 2:
+            return np.inf
+        variance = self.sum_sq_dev / (self.samples - 1)
+        return self.volume_element * np.sqrt(variance / self.samples)
+
+    @property
+    def effective_sample_size(self) -> float:
+        """Kish's effective sample size of the function sample weights."""
+        if self.sum_weights_sq == 0:
+            return 0.
+        return self.sum_weights**2 / self.sum_weights_sq
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "samples": int(self.samples),
+            "estimate": float(self.estimate),
+            "error": float(self.error),
+            "max_weight": float(self.max_weight),
+            "effective_sample_size": float(self.effective_sample_size),
+        }
+
+    def _update(self, function_samples: NDArray[np.float64]):
+        """Merges the statistics of a chunk using the parallel variant of
+        Welford's algorithm."""
+        samples = len(function_samples)
+        if samples == 0:
+            return
+        mean = np.mean(function_samples)
+        sum_sq_dev = np.sum((function_samples - mean)**2)
+        delta = mean - self.mean
+        total = self.samples + samples
+        self.mean += delta * samples / total
+        self.sum_sq_dev += sum_sq_dev + delta**2 * self.samples * samples / total
+        self.samples = total
+        self.sum_weights += np.sum(function_samples)
+        self.sum_weights_sq += np.sum(function_samples**2)
+        self.max_weight = max(self.max_weight, np.max(function_samples))
+
+    def add(self, function_samples: NDArray[np.float64]):
+        """Add a chunk of function samples, splitting it at the checkpoints
+        that fall within it."""
+        function_samples = np.asarray(function_samples, dtype=np.float64)
+        start = 0
+        while self._next_checkpoint < len(self.checkpoints):
+            offset = self.checkpoints[self._next_checkpoint] - self.samples
+            if offset > len(function_samples) - start:
+                break
+            self._update(function_samples[start:start + offset])
+            start += offset
+            self.history.append(self.summary())
+            self._next_checkpoint += 1
+        self._update(function_samples[start:])
+
+def integrate_streaming(
+    func: IntegrableFunction,
+    samples: int,
+    sampler: Sampler,
+    volume_element: float,
+    checkpoints: Iterable[int] | None = None,
+    chunk_size: int = 100_000,
+    observables: Iterable[tuple[Observable,
+                                utils.histogram.ArrayHistogram]] = ()
+) -> RunningIntegral:
+    """Integrate the function using MC methods in a single streaming pass of
+    `samples` samples drawn in chunks, recording the convergence at the
+    sample counts `checkpoints` (log-spaced by default).
+
+    Each of the `observables` is a pair of a function of the sample array,
+    returning one coordinate array per histogram axis (or a single array for
+    1D histograms), and an array-backed histogram. It is filled with the
+    samples weighted by their contribution to the integral, so that the
+    histograms sum up to the integral estimate once all samples are drawn."""
+    if checkpoints is None:
+        checkpoints = log_checkpoints(samples)
+    observables = list(observables)
+    accumulator = RunningIntegral(volume_element, checkpoints)
+    while accumulator.samples < samples:
+        chunk = min(chunk_size, samples - accumulator.samples)
+        mc_numbers = sampler(chunk)
+        function_samples = func(mc_numbers)
+        accumulator.add(function_samples)
+        weights = function_samples * volume_element / samples
+        for observable, histogram in observables:
+            coords = observable(mc_numbers)
+            if isinstance(coords, np.ndarray):
+                coords = [coords]
+            histogram.fill_array(coords, weights)
+    return accumulator
+
+class RunningIntegrals:
+    """Online accumulator of several MC integrals over the same samples, that
+    is fed one row of function samples per integral chunk by chunk and keeps
+    the covariance between the estimates."""
+
+    def __init__(self, volume_element: float, names: Iterable[str]):
+        self.volume_element = volume_element
+        self.names = list(names)
+        self.samples = 0
+        self.mean = np.zeros(len(self.names))
+        self.co_moment = np.zeros((len(self.names), len(self.names)))
+
+    @property
+    def estimate(self) -> NDArray[np.float64]:
+        return self.volume_element * self.mean
+
+    @property
+    def covariance(self) -> NDArray[np.float64]:
+        """Covariance matrix of the estimates."""
+        if self.samples < 2:
+            return np.full_like(self.co_moment, np.inf)
+        return self.volume_element**2 * self.co_moment / \
+            (self.samples - 1) / self.samples
+
+    @property
+    def error(self) -> NDArray[np.float64]:
+        """Statistical errors of the estimates."""
+        return np.sqrt(np.diag(self.covariance))
+
+    def estimates(self) -> dict[str, float]:
+        return dict(zip(self.names, self.estimate.tolist()))
+
+    def add(self, function_samples: NDArray[np.float64]):
+        """Add a chunk of function samples of shape (integrals, samples),
+        merging its mean and co-moment with the vector form of the parallel
+        Welford algorithm."""
+        function_samples = np.asarray(function_samples, dtype=np.float64)
+        samples = function_samples.shape[-1]
+        if samples == 0:
+            return
+        mean = np.mean(function_samples, axis=-1)
+        deviations = function_samples - mean[:, None]
+        delta = mean - self.mean
+        total = self.samples + samples
+        self.mean += delta * samples / total
+        self.co_moment += deviations @ deviations.T + \
+            np.outer(delta, delta) * self.samples * samples / total
+        self.samples = total
+
+def integrate_multiple(
+    integrands: dict[str, IntegrableFunction] | IntegrableFunction,
+    samples: int,
+    sampler: Sampler,
+    volume_element: float,
+    weight: IntegrableFunction | None = None,
+    chunk_size: int = 100_000
+) -> RunningIntegrals:
+    """Integrate several functions on the same `samples` samples, drawn in
+    chunks by `sampler`.
+
+    `integrands` is either a dictionary of functions of the sample array or a
+    single vector-valued function returning an array of shape
+    (integrals, samples). If a `weight` function is given, e.g. a
+    differential cross section, it is evaluated once per chunk and multiplies
+    all integrands, which then only need to compute their projection, e.g.
+    cos(theta) for the first moment or a flavour indicator. Integrands
+    returning a constant are broadcast to all samples.
+
+    Returns the accumulator, holding the `estimate` and `error` of each
+    integral and the `covariance` matrix between them in the order of
+    `integrands`, or named by index for a vector-valued integrand."""
+    accumulator = None
+    while accumulator is None or accumulator.samples < samples:
+        drawn = 0 if accumulator is None else accumulator.samples
+        chunk = min(chunk_size, samples - drawn)
+        mc_numbers = sampler(chunk)
+        if isinstance(integrands, dict):
+            function_samples = np.array([
+                np.broadcast_to(func(mc_numbers), (chunk,))
+                for func in integrands.values()
+            ], dtype=np.float64)
+            names = integrands.keys()
+        else:
+            function_samples = np.atleast_2d(integrands(mc_numbers))
+            names = map(str, range(len(function_samples)))
+        if weight is not None:
+            function_samples = function_samples * weight(mc_numbers)
+        if accumulator is None:
+            accumulator = RunningIntegrals(volume_element, names)
+        accumulator.add(function_samples)
+    return accumulator
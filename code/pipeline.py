@@ -0,0 +1,347 @@
+"""Module that runs event generation, showering and analysis as a staged
+pipeline with bounded queues between the stages.
+
+A generator stage produces batches of events, `workers` shower stages shower
+them and the analysis stage in the calling thread consumes the showered
+batches. Since the queues are bounded, a slow stage blocks the ones feeding
+it, which keeps the number of events in flight bounded. The shower workers can
+run as threads or as processes, the latter being required to scale the pure
+Python shower beyond one core.
+"""
+
+import multiprocessing
+import pickle
+import queue
+import random
+import threading
+import time
+import traceback
+from typing import Callable
+
+import numpy as np
+
+import integrate
+import utils.analysis
+import utils.shower
+
+ShowerFactory = Callable[[], utils.shower.Shower]
+
+class StageMetrics:
+    """Throughput bookkeeping of a pipeline stage."""
+
+    def __init__(self, name: str, workers: int = 1):
+        self.name = name
+        self.workers = workers
+        self.events = 0
+        self.batches = 0
+        self.busy_time = 0.
+        self.wait_time = 0.
+        self.start = time.perf_counter()
+        self.stop = self.start
+
+    def merge(self, other: "StageMetrics"):
+        """Adds the counters of another worker of the same stage."""
+        self.events += other.events
+        self.batches += other.batches
+        self.busy_time += other.busy_time
+        self.wait_time += other.wait_time
+        self.start = min(self.start, other.start)
+        self.stop = max(self.stop, other.stop)
+
+    def as_dict(self) -> dict:
+        wall_time = self.stop - self.start
+        return {
+            "workers": self.workers,
+            "events": self.events,
+            "batches": self.batches,
+            "busy_time": self.busy_time,
+            "wait_time": self.wait_time,
+            "wall_time": wall_time,
+            "events_per_second": self.events / wall_time if wall_time else 0.,
+            "events_per_busy_second":
+                self.events / self.busy_time if self.busy_time else 0.,
+        }
+
+class StageError:
+    """Terminal item of a stage that failed, carrying the `error` and its
+    formatted traceback, which does not survive pickling."""
+
+    def __init__(self, name: str, error: BaseException):
+        self.name = name
+        self.traceback = traceback.format_exc()
+        try:
+            pickle.dumps(error)
+        except Exception:
+            error = RuntimeError(repr(error))
+        self.error = error
+
+class RemoteTraceback(Exception):
+    """Cause of an error re-raised from a stage, showing where it occurred."""
+
+    def __str__(self):
+        return "\n\n" + self.args[0]
+
+# seconds between checks of the stop event while waiting on a queue
+POLL_INTERVAL = .1
+
+def _timed_put(out_queue, item, metrics: StageMetrics, stop) -> bool:
+    """Puts `item` into `out_queue`, waiting while it is full. Returns False
+    without putting it if `stop` is set in the meantime."""
+    start = time.perf_counter()
+    try:
+        while True:
+            try:
+                out_queue.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                if stop.is_set():
+                    return False
+    finally:
+        metrics.wait_time += time.perf_counter() - start
+
+def _timed_get(in_queue, metrics: StageMetrics, stop):
+    """Gets an item from `in_queue`, waiting while it is empty. Returns None
+    if `stop` is set in the meantime."""
+    start = time.perf_counter()
+    try:
+        while True:
+            try:
+                return in_queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if stop.is_set():
+                    return None
+    finally:
+        metrics.wait_time += time.perf_counter() - start
+
+def generate_batches(
+    out_queue,
+    events: int,
+    batch_size: int,
+    interval: integrate.IntegrationInterval,
+    s: float,
+    seed: int,
+    workers: int,
+    metrics: StageMetrics,
+    stop,
+    errors: list
+):
+    """Generator stage: puts (index, batch of events) items into `out_queue`,
+    followed by one `None` per shower worker. An error is appended to
+    `errors` and sets `stop`, which ends the other stages."""
+    try:
+        np.random.seed(seed)
+        for index, first in enumerate(range(0, events, batch_size)):
+            if stop.is_set():
+                break
+            start = time.perf_counter()
+            batch = list(
+                integrate.event_generator(
+                    min(batch_size, events - first), interval, s
+                )
+            )
+            metrics.busy_time += time.perf_counter() - start
+            metrics.events += len(batch)
+            metrics.batches += 1
+            if not _timed_put(out_queue, (index, batch), metrics, stop):
+                break
+    except BaseException as error:
+        errors.append(StageError(metrics.name, error))
+        stop.set()
+    finally:
+        for _ in range(workers):
+            if not _timed_put(out_queue, None, metrics, stop):
+                break
+        metrics.stop = time.perf_counter()
+
+def shower_batches(
+    in_queue,
+    out_queue,
+    shower_factory: ShowerFactory,
+    s: float,
+    seed: int,
+    metrics: StageMetrics,
+    stop
+):
+    """Shower stage: showers the batches from `in_queue` and puts them into
+    `out_queue` together with the variation weights of each event. The shower
+    is seeded per batch, so that results do not depend on which worker
+    showers which batch. Always finishes by putting a terminal item into
+    `out_queue`, its metrics or, if it failed, a `StageError`."""
+    result = metrics
+    try:
+        shower = shower_factory()
+        while True:
+            item = _timed_get(in_queue, metrics, stop)
+            if item is None:
+                break
+            index, batch = item
+            start = time.perf_counter()
+            random.seed("{0}-{1}".format(seed, index))
+            weights = []
+            for event in batch:
+                shower.run(event, s)
+                weights.append(dict(shower.weights))
+            metrics.busy_time += time.perf_counter() - start
+            metrics.events += len(batch)
+            metrics.batches += 1
+            if not _timed_put(out_queue, (batch, weights), metrics, stop):
+                break
+    except BaseException as error:
+        result = StageError(metrics.name, error)
+    finally:
+        metrics.stop = time.perf_counter()
+        # run_pipeline consumes the terminal items until the end, also after a
+        # failure, so that this put cannot block forever
+        out_queue.put(result)
+
+def _raise(error: StageError):
+    raise error.error from RemoteTraceback(error.traceback)
+
+def run_pipeline(
+    events: int,
+    shower_factory: ShowerFactory,
+    analysis: utils.analysis.Analysis,
+    interval: integrate.IntegrationInterval,
+    s: float,
+    batch_size: int = 100,
+    workers: int = 1,
+    processes: bool = False,
+    queue_size: int = 4,
+    seed: int = 42,
+    weight: float = 1.
+) -> dict:
+    """Generates `events` events, showers them with showers created by
+    `shower_factory` in `workers` threads (or processes, if `processes` is
+    set) and analyzes them with `analysis` in the calling thread.
+
+    Each queue holds at most `queue_size` batches of `batch_size` events. In
+    process mode, `shower_factory` has to be picklable, e.g. a
+    `functools.partial` of `Shower`.
+
+    If a stage fails, the other stages are stopped and the error is re-raised
+    here, with the traceback of the failing stage as its cause. A shower
+    process that dies without reporting, e.g. when it is killed, raises a
+    RuntimeError.
+
+    Returns the metrics of each stage as a dictionary."""
+    if processes:
+        context = multiprocessing.get_context()
+        Queue, Worker, Event = context.Queue, context.Process, context.Event
+    else:
+        Queue, Worker, Event = queue.Queue, threading.Thread, threading.Event
+    event_queue = Queue(maxsize=queue_size)
+    showered_queue = Queue(maxsize=queue_size)
+    stop = Event()
+    generator_errors = []
+
+    generator_metrics = StageMetrics("generator")
+    generator = threading.Thread(
+        target=generate_batches,
+        args=(
+            event_queue,
+            events,
+            batch_size,
+            interval,
+            s,
+            seed,
+            workers,
+            generator_metrics,
+            stop,
+            generator_errors
+        ),
+        daemon=True
+    )
+    shower_workers = [
+        Worker(
+            target=shower_batches,
+            args=(
+                event_queue,
+                showered_queue,
+                shower_factory,
+                s,
+                seed,
+                StageMetrics("shower"),
+                stop
+            ),
+            daemon=True
+        ) for _ in range(workers)
+    ]
+    generator.start()
+    for worker in shower_workers:
+        worker.start()
+
+    analysis_metrics = StageMetrics("analysis")
+    shower_metrics = StageMetrics("shower", workers)
+    errors = []
+    finished = 0
+    try:
+        while finished < workers:
+            try:
+                item = showered_queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if processes and \
+                   sum(not w.is_alive() for w in shower_workers) > finished:
+                    # a terminal item is written before a process exits, so
+                    # check once more before giving up on it
+                    try:
+                        item = showered_queue.get(timeout=1.)
+                    except queue.Empty:
+                        raise RuntimeError(
+                            "A shower process died without reporting."
+                        ) from None
+                else:
+                    continue
+            if isinstance(item, (StageMetrics, StageError)):
+                if isinstance(item, StageError):
+                    errors.append(item)
+                    stop.set()
+                else:
+                    shower_metrics.merge(item)
+                finished += 1
+                continue
+            if stop.is_set():
+                continue
+            batch, variation_weights = item
+            start = time.perf_counter()
+            for event, event_weights in zip(batch, variation_weights):
+                analysis.analyze(event, weight, event_weights)
+            analysis_metrics.busy_time += time.perf_counter() - start
+            analysis_metrics.events += len(batch)
+            analysis_metrics.batches += 1
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        analysis_metrics.stop = time.perf_counter()
+        if stop.is_set():
+            _shutdown(generator, shower_workers, event_queue, showered_queue)
+        else:
+            generator.join()
+            for worker in shower_workers:
+                worker.join()
+
+    errors += generator_errors
+    if errors:
+        _raise(errors[0])
+    return {
+        metrics.name: metrics.as_dict()
+        for metrics in (generator_metrics, shower_metrics, analysis_metrics)
+    }
+
+def _shutdown(generator, shower_workers, event_queue, showered_queue):
+    """Joins the stages after the stop event was set, draining the queues so
+    that no stage stays blocked on a full queue."""
+    for stage_queue in (event_queue, showered_queue):
+        if hasattr(stage_queue, "cancel_join_thread"):
+            # items left in a process queue must not block the exit
+            stage_queue.cancel_join_thread()
+    while generator.is_alive() or any(w.is_alive() for w in shower_workers):
+        for stage_queue in (event_queue, showered_queue):
+            try:
+                while True:
+                    stage_queue.get_nowait()
+            except queue.Empty:
+                pass
+        generator.join(POLL_INTERVAL)
+        for worker in shower_workers:
+            worker.join(POLL_INTERVAL)
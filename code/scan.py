@@ -0,0 +1,259 @@
+"""Module that scans the integration, shower and analysis chain over a grid of
+centre-of-mass energies, shower cut-offs and strong couplings.
+
+Each grid point is run with its own fixed seed and its results are cached on
+disk under a hash of its full configuration, including a hash of the source
+code. Re-running a scan therefore only computes the points that are new or
+whose configuration changed, e.g. after extending the grid:
+
+    python -m scan --sqrt-s 30 91.2 200 --t0 1 4 --workers 4
+"""
+
+import argparse
+import concurrent.futures
+import functools
+import hashlib
+import itertools
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+import constants as const
+import integrate
+
+# scanned parameters and their values if not part of the grid
+DEFAULTS = {
+    "sqrt_s": const.Z_MASS,
+    "t0": 1.,
+    "asmz": const.QCD_COUPLING_Z_MASS,
+}
+# theta and phi are sampled uniformly in INTERVAL, the flavour uniformly among
+# the light quarks
+INTERVAL = [[0, np.pi], [-np.pi, np.pi]]
+VOLUME_ELEMENT = np.pi * 2 * np.pi * const.NUM_LIGHT_QUARK_FLAV
+
+def code_version() -> str:
+    """Returns a hash of all Python sources of the chain, so that cached
+    results are not reused after the code changed."""
+    root = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha1()
+    for directory, _, files in sorted(os.walk(root)):
+        for name in sorted(files):
+            if name.endswith(".py"):
+                path = os.path.join(directory, name)
+                digest.update(os.path.relpath(path, root).encode())
+                with open(path, "rb") as file:
+                    digest.update(file.read())
+    return digest.hexdigest()[:16]
+
+def grid_points(grid: dict[str, list[float]]) -> list[dict[str, float]]:
+    """Returns all combinations of the values in `grid`, which maps some of
+    the parameters in `DEFAULTS` to lists of values, in a fixed order. The
+    other parameters take their default values."""
+    unknown = set(grid) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(
+            "Unknown scan parameters: {0}".format(", ".join(sorted(unknown)))
+        )
+    names = list(DEFAULTS)
+    values = [grid.get(name, [DEFAULTS[name]]) for name in names]
+    return [
+        dict(zip(names, map(float, point)))
+        for point in itertools.product(*values)
+    ]
+
+def config_hash(config: dict) -> str:
+    return hashlib.sha1(
+        json.dumps(config, sort_keys=True).encode()
+    ).hexdigest()[:16]
+
+def diff_cross_section(theta_phi_flav_array, s: float):
+    """Returns the differential cross section dsigma/dOmega of e+e- -> q qbar
+    in pb, times the Jacobian sin(theta) of the uniformly sampled polar
+    angle. `const.scattering_mat` already is the squared matrix element."""
+    theta = theta_phi_flav_array[..., 0]
+    phi = theta_phi_flav_array[..., 1]
+    flav = theta_phi_flav_array[..., 2]
+    matrix_element = const.scattering_mat(flav, s, np.cos(theta), phi)
+    return const.CONVERSION_FACTOR * matrix_element / 64 / np.pi**2 / s * \
+        np.sin(theta)
+
+def total_cross_section(s: float) -> float:
+    """Returns the analytic total cross section of e+e- -> q qbar in pb,
+    summed over the light quarks. The squared matrix element is
+    A cos(theta) + B (1 + cos(theta)^2), whose first term vanishes in the
+    integral over the solid angle and whose second gives 16 pi / 3 B, where
+    B is its value at cos(theta) = 0."""
+    flavors = np.arange(1, const.NUM_LIGHT_QUARK_FLAV + 1)
+    b = const.scattering_mat(flavors, s, 0., 0.)
+    return float(
+        np.sum(
+            const.CONVERSION_FACTOR * b / 64 / np.pi**2 / s * 16 *
+            np.pi / 3
+        )
+    )
+
+def run_point(config: dict, directory: str) -> dict:
+    """Integrates the cross section, showers and analyses the events of the
+    grid point `config` and stores the histograms and a JSON summary in
+    `directory`. Returns the summary."""
+    from utils.alphas import AlphaS
+    from utils.analysis import Analysis
+    from utils.shower import Shower
+    from utils.storage import atomic_file
+
+    start = time.perf_counter()
+    random.seed(config["seed"])
+    np.random.seed(config["seed"])
+    s = config["sqrt_s"]**2
+    cross_section = integrate.integrate_streaming(
+        functools.partial(diff_cross_section, s=s),
+        config["samples"],
+        functools.partial(
+            integrate.quark_scattering_process, interval=INTERVAL
+        ),
+        VOLUME_ELEMENT,
+        checkpoints=[]
+    )
+
+    shower = Shower(
+        AlphaS(const.Z_MASS**2, config["asmz"]), t0=config["t0"]
+    )
+    analysis = Analysis()
+    # finalize divides by the number of events
+    weight = cross_section.estimate
+    multiplicity = 0
+    for event in integrate.event_generator(config["events"], INTERVAL, s):
+        shower.run(event, s)
+        analysis.analyze(event, weight)
+        multiplicity += len(event) - 2
+
+    os.makedirs(directory, exist_ok=True)
+    analysis.finalize(os.path.join(directory, "analysis.yoda"))
+    result = {
+        "config": config,
+        "cross_section": cross_section.estimate,
+        "cross_section_error": cross_section.error,
+        "mean_multiplicity": multiplicity / config["events"],
+        "yoda": os.path.join(directory, "analysis.yoda"),
+        "time": time.perf_counter() - start,
+    }
+    # the summary marks a finished point, write it last and atomically
+    file_name = os.path.join(directory, "result.json")
+    with atomic_file(file_name) as temporary:
+        with open(temporary, "w") as file:
+            json.dump(result, file, indent=2)
+    return result
+
+def load_point(directory: str) -> dict | None:
+    """Returns the cached summary in `directory`, or None if the point has
+    not been run to completion."""
+    try:
+        with open(os.path.join(directory, "result.json")) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def run_scan(
+    grid: dict[str, list[float]],
+    events: int = 1000,
+    samples: int = 100_000,
+    seed: int = 42,
+    cache_dir: str = "scan_cache",
+    workers: int = 1,
+    verbose: bool = True
+) -> list[dict]:
+    """Runs all points of `grid`, see `grid_points`, with `events` showered
+    events and `samples` integration samples each, reusing the results cached
+    in `cache_dir`. The missing points are run in `workers` processes.
+
+    Returns the summaries of all points in grid order, each with a `cached`
+    flag telling whether it was taken from the cache."""
+    version = code_version()
+    configs = [
+        dict(point, events=events, samples=samples, seed=seed,
+             code_version=version) for point in grid_points(grid)
+    ]
+    directories = [
+        os.path.join(cache_dir, config_hash(config)) for config in configs
+    ]
+    results = [load_point(directory) for directory in directories]
+    for result in results:
+        if result is not None:
+            result["cached"] = True
+    missing = [i for i, result in enumerate(results) if result is None]
+    if verbose:
+        print(
+            "{0} points, {1} cached, {2} to run".format(
+                len(configs), len(configs) - len(missing), len(missing)
+            ),
+            file=sys.stderr
+        )
+
+    if workers > 1 and len(missing) > 1:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = {
+                executor.submit(run_point, configs[i], directories[i]): i
+                for i in missing
+            }
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+    else:
+        for i in missing:
+            results[i] = run_point(configs[i], directories[i])
+    for i in missing:
+        results[i]["cached"] = False
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sqrt-s", nargs="+", type=float)
+    parser.add_argument("--t0", nargs="+", type=float)
+    parser.add_argument("--asmz", nargs="+", type=float)
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--samples", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--cache-dir", default="scan_cache")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("-o", "--output", help="JSON file to write results to")
+    args = parser.parse_args(argv)
+
+    grid = {
+        name: values
+        for name, values in (
+            ("sqrt_s", args.sqrt_s), ("t0", args.t0), ("asmz", args.asmz)
+        ) if values is not None
+    }
+    results = run_scan(
+        grid,
+        args.events,
+        args.samples,
+        args.seed,
+        args.cache_dir,
+        args.workers
+    )
+    for result in results:
+        config = result["config"]
+        print(
+            "sqrt_s={0:<8g} t0={1:<6g} asmz={2:<6g} sigma={3:.5g} +- {4:.2g} "
+            "<n>={5:.2f}{6}".format(
+                config["sqrt_s"],
+                config["t0"],
+                config["asmz"],
+                result["cross_section"],
+                result["cross_section_error"],
+                result["mean_multiplicity"],
+                "  (cached)" if result["cached"] else ""
+            )
+        )
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,12 @@
+from utils.analysis import Analysis
+
+def test_correlations_are_booked_on_request():
+    assert Analysis(variations=["up"]).observables == []
+    analysis = Analysis(variations=["up"], correlations=True)
+    names = [h.name for h, _, _ in analysis.observables]
+    assert names == [
+        "/LL_JetRates/log10_y_23_vs_log10_y_34",
+        "/LL_JetRates/multiplicity_vs_log10_y_23",
+    ]
+    assert [h.name for h, _, _ in analysis.variations["up"].observables] == \
+        names
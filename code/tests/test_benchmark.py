@@ -0,0 +1,39 @@
+import pytest
+
+import benchmark
+
+def integrate_results(events=10000):
+    result = benchmark.measure(
+        benchmark.stage_integrate, events, t0=1., repeat=1
+    )
+    return {"results": {"integrate": [result]}}
+
+def test_integrate_stage_matches_analytic_cross_section():
+    results = integrate_results()
+    integral = results["results"]["integrate"][0]["integral"]
+    benchmark.check_cross_section(integral)
+    assert benchmark.compare_results(results, results, .1) == []
+
+def test_compare_results_rejects_wrong_cross_section():
+    results = integrate_results()
+    integral = results["results"]["integrate"][0]["integral"]
+    integral["estimate"] *= 2.
+    with pytest.raises(ValueError, match="does not match"):
+        benchmark.compare_results(results, results, .1)
+
+def test_imports_do_not_load_heavy_modules():
+    result = benchmark.measure_imports(
+        benchmark.WORKER_MODULES + ["benchmark"], repeat=1
+    )
+    assert result["heavy_modules"] == []
+
+def test_shower_jit_stage_is_skipped_without_numba(monkeypatch):
+    import utils.shower_jit
+    monkeypatch.setattr(utils.shower_jit, "available", False)
+    results = benchmark.run_benchmarks(
+        ["shower_jit"], [10], [4.], repeat=1, verbose=False
+    )
+    assert results["results"] == {}
+    assert results["meta"]["skipped"] == {
+        "shower_jit": "numba is not installed"
+    }
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from utils.histogram import (
+    ArrayHisto1D, Histo1D, Histo2D, Profile1D, Scatter2D
+)
+
+# unit-weight entries drawn uniformly from [0, 1), so that each of BINS bins
+# holds N / BINS entries on average, with a Poisson error of sqrt(N / BINS)
+N = 10000
+BINS = 10
+REPLICAS = 500
+# the spread of REPLICAS replicas has a relative uncertainty of about
+# 1 / sqrt(2 REPLICAS) = 3%
+TOLERANCE = .15
+
+@pytest.fixture
+def points():
+    return np.random.default_rng(3).uniform(0., 1., (2, N))
+
+def test_histo1d_replicas(points):
+    histo = Histo1D(BINS, 0., 1., replicas=REPLICAS, seed=1)
+    for x in points[0].tolist():
+        histo.fill(x, 1.)
+    # Histo1D.fill books the entries of the last bin in the overflow
+    errors = histo.bootstrap_errors()[:-1]
+    np.testing.assert_allclose(errors, np.sqrt(N / BINS), rtol=TOLERANCE)
+    # the replicas scatter around the nominal content
+    means = histo.replicas[:, 1:-2].mean(axis=0)
+    contents = np.array([b.w for b in histo.bins[:-1]])
+    assert np.all(np.abs(means - contents) < 5. * errors / np.sqrt(REPLICAS))
+
+def test_array_histo1d_replicas(points):
+    histo = ArrayHisto1D(BINS, 0., 1., replicas=REPLICAS, seed=1)
+    histo.fill_array([points[0]])
+    errors = histo.bootstrap_errors()[1:-1]
+    np.testing.assert_allclose(errors, np.sqrt(N / BINS), rtol=TOLERANCE)
+    # with weights, the error is sqrt(sumw2)
+    histo = ArrayHisto1D(BINS, 0., 1., replicas=REPLICAS, seed=2)
+    histo.fill_array([points[0]], 1. + points[1])
+    np.testing.assert_allclose(
+        histo.bootstrap_errors()[1:-1],
+        np.sqrt(histo.data[1, 1:-1]),
+        rtol=TOLERANCE
+    )
+
+def test_histo2d_replicas(points):
+    histo = Histo2D(4, 0., 1., 5, 0., 1., replicas=REPLICAS, seed=1)
+    histo.fill_array(points)
+    errors = histo.bootstrap_errors()[1:-1, 1:-1]
+    assert errors.shape == (4, 5)
+    np.testing.assert_allclose(errors, np.sqrt(N / 20), rtol=TOLERANCE)
+    # the outflows are empty
+    assert not histo.replicas[0, :, 0].any()
+    assert not histo.replicas[0, :, :, -1].any()
+
+def test_profile1d_replicas(points):
+    sigma = 2.
+    y = np.random.default_rng(4).normal(0., sigma, N)
+    profile = Profile1D(BINS, 0., 1., replicas=REPLICAS, seed=1)
+    profile.fill_array([points[0], y])
+    # the error of the mean of y in a bin of about N / BINS entries
+    np.testing.assert_allclose(
+        profile.mean_errors(), sigma / np.sqrt(N / BINS), rtol=TOLERANCE
+    )
+
+def test_scatter2d_replicas(points):
+    scatter = Scatter2D(BINS, 0., 1., replicas=REPLICAS, seed=1)
+    for x in points[0].tolist():
+        scatter.fill_range(-float("inf"), x, 1.)
+    # each point counts the entries above it, N (1 - x) on average
+    errors = scatter.bootstrap_errors()
+    np.testing.assert_allclose(
+        errors, np.sqrt(N * (1. - scatter.x)), rtol=TOLERANCE
+    )
+    assert [p.yerr for p in scatter.points] == [[e, e] for e in errors]
@@ -0,0 +1,96 @@
+import functools
+
+import numpy as np
+import pytest
+
+import integrate
+
+INTERVAL = [[0., np.pi], [-1., 2.]]
+VOLUME_ELEMENT = np.pi * 3.
+
+def integrand(samples):
+    return np.sin(samples[..., 0]) * (1. + samples[..., 1]**2)
+
+sampler = functools.partial(integrate.uniform_sampler, interval=INTERVAL)
+
+def test_streaming_matches_integrate_sampler():
+    realizations = 100
+    samples = 1000
+    np.random.seed(11)
+    mean, std = integrate.integrate_sampler(
+        integrand, samples, sampler, VOLUME_ELEMENT, realizations
+    )
+    # the chunks draw the same random numbers as the realizations
+    np.random.seed(11)
+    result = integrate.integrate_streaming(
+        integrand,
+        realizations * samples,
+        sampler,
+        VOLUME_ELEMENT,
+        chunk_size=777
+    )
+    assert result.estimate == pytest.approx(mean, rel=1.e-12)
+    # the spread of the realizations estimates the error of `samples`
+    # samples, with a relative uncertainty of 1 / sqrt(2 realizations)
+    assert result.error * np.sqrt(realizations) == pytest.approx(std, rel=.3)
+
+def test_streaming_error_and_checkpoints():
+    np.random.seed(12)
+    values = integrand(sampler(10_000))
+    np.random.seed(12)
+    result = integrate.integrate_streaming(
+        integrand,
+        10_000,
+        sampler,
+        VOLUME_ELEMENT,
+        checkpoints=[10, 2500, 10_000],
+        chunk_size=1000
+    )
+    assert result.error == pytest.approx(
+        VOLUME_ELEMENT * np.std(values, ddof=1) / np.sqrt(len(values)),
+        rel=1.e-10
+    )
+    assert [entry["samples"] for entry in result.history] == \
+        [10, 2500, 10_000]
+    assert result.history[0]["estimate"] == pytest.approx(
+        VOLUME_ELEMENT * np.mean(values[:10]), rel=1.e-12
+    )
+
+def test_multiple_covariance_matches_np_cov():
+    drawn = []
+
+    def recording_sampler(samples):
+        drawn.append(sampler(samples))
+        return drawn[-1]
+
+    integrands = {
+        "f": integrand,
+        "cos": lambda samples: np.cos(samples[..., 0]),
+        "one": lambda samples: 1.,
+    }
+    np.random.seed(13)
+    result = integrate.integrate_multiple(
+        integrands,
+        5000,
+        recording_sampler,
+        VOLUME_ELEMENT,
+        weight=lambda samples: 1. + samples[..., 1],
+        chunk_size=1234
+    )
+    samples = np.concatenate(drawn)
+    assert len(samples) == 5000
+    weights = 1. + samples[..., 1]
+    values = np.array([
+        integrand(samples) * weights,
+        np.cos(samples[..., 0]) * weights,
+        weights,
+    ])
+    np.testing.assert_allclose(
+        result.estimate, VOLUME_ELEMENT * values.mean(axis=1), rtol=1.e-12
+    )
+    np.testing.assert_allclose(
+        result.covariance,
+        VOLUME_ELEMENT**2 * np.cov(values) / values.shape[1],
+        rtol=1.e-10
+    )
+    assert list(result.estimates()) == list(integrands)
@@ -0,0 +1,93 @@
+import math as m
+
+import numpy as np
+import pytest
+
+from utils.jets import SCHEMES, cluster, recombine
+from utils.vector import Vec4
+
+Q2 = 91.2**2
+
+def random_momenta(rng, n):
+    """Returns `n` massless momenta with random directions and energies."""
+    momenta = []
+    for _ in range(n):
+        energy = rng.uniform(.5, 45.)
+        cos_theta = rng.uniform(-1., 1.)
+        sin_theta = m.sqrt(1. - cos_theta**2)
+        phi = rng.uniform(-m.pi, m.pi)
+        momenta.append(
+            Vec4(
+                energy, energy * sin_theta * m.cos(phi),
+                energy * sin_theta * m.sin(phi), energy * cos_theta
+            )
+        )
+    return momenta
+
+def measures(p, q):
+    """Returns y_pq and 1 - cos(theta_pq), computed independently of
+    `utils.jets`."""
+    cos_theta = (p.px * q.px + p.py * q.py + p.pz * q.pz) / \
+        (p.length_3d() * q.length_3d())
+    one_minus_cos = 1. - min(max(cos_theta, -1.), 1.)
+    return 2. * min(p.E, q.E)**2 * one_minus_cos / Q2, one_minus_cos
+
+def reference_cluster(momenta, y_cut, n_jets, algorithm, scheme):
+    """Clusters by searching all pairs in every step, which takes O(n^3)
+    distance evaluations. Returns the scales and the sets of constituents of
+    the jets."""
+    jets = [(p, {i}) for i, p in enumerate(momenta)]
+    frozen = []
+    scales = []
+    while len(jets) > n_jets:
+        pairs = [
+            (measures(jets[a][0], jets[b][0]), a, b)
+            for a in range(len(jets)) for b in range(a + 1, len(jets))
+        ]
+        if algorithm == "durham":
+            (y, _), a, b = min(pairs, key=lambda pair: pair[0][0])
+            if y_cut is not None and y > y_cut:
+                break
+        else:
+            (y, _), a, b = min(pairs, key=lambda pair: pair[0][1])
+            if y >= y_cut:
+                softer = a if jets[a][0].E < jets[b][0].E else b
+                frozen.append(jets.pop(softer))
+                continue
+        scales.append(y)
+        (p, p_constituents), (q, q_constituents) = jets[a], jets[b]
+        jets[a] = (recombine(p, q, scheme), p_constituents | q_constituents)
+        del jets[b]
+    return scales, [constituents for _, constituents in frozen + jets]
+
+CASES = [
+    ("durham", None, 1),
+    ("durham", None, 2),
+    ("durham", .01, 1),
+    ("durham", .1, 2),
+    ("cambridge", .01, 1),
+    ("cambridge", .1, 2),
+]
+
+@pytest.mark.parametrize("scheme", SCHEMES)
+@pytest.mark.parametrize("algorithm, y_cut, n_jets", CASES)
+def test_cluster_matches_brute_force(algorithm, y_cut, n_jets, scheme):
+    rng = np.random.default_rng(7)
+    for n in list(range(1, 8)) * 3 + [15, 25]:
+        momenta = random_momenta(rng, n)
+        result = cluster(
+            momenta,
+            Q2,
+            y_cut=y_cut,
+            n_jets=n_jets,
+            algorithm=algorithm,
+            scheme=scheme
+        )
+        scales, constituents = reference_cluster(
+            momenta, y_cut, n_jets, algorithm, scheme
+        )
+        assert result.scales == pytest.approx(scales, rel=1.e-12)
+        assert len(result.jets) == len(constituents)
+        assert sorted(
+            result.constituents(jet) for jet in range(len(result.jets))
+        ) == sorted(sorted(jet) for jet in constituents)
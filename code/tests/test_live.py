@@ -0,0 +1,59 @@
+import random
+
+import numpy as np
+import pytest
+
+import constants as const
+import integrate
+from utils import live
+from utils.alphas import AlphaS
+from utils.analysis import Analysis
+from utils.shower import Shower
+from utils.validation import compare_files
+
+S = const.Z_MASS**2
+INTERVAL = [[0, np.pi], [-np.pi, np.pi]]
+WORKERS = 2
+
+@pytest.fixture(scope="module")
+def events():
+    random.seed(5)
+    np.random.seed(5)
+    shower = Shower(AlphaS(S, const.QCD_COUPLING_Z_MASS), t0=1.)
+    events = list(integrate.event_generator(200, INTERVAL, S))
+    for event in events:
+        shower.run(event, S)
+    return events
+
+@pytest.fixture
+def block():
+    block = live.LiveBlock.create(WORKERS)
+    yield block
+    block.close()
+    block.unlink()
+
+def test_export_matches_the_analysis_output(events, block, tmp_path):
+    direct = Analysis()
+    workers = [Analysis() for _ in range(WORKERS)]
+    for i, analysis in enumerate(workers):
+        analysis.share(block.slot(i))
+    for i, event in enumerate(events):
+        direct.analyze(event, 1.)
+        workers[i % WORKERS].analyze(event, 1.)
+    reference = str(tmp_path / "analysis.yoda")
+    direct.finalize(reference)
+
+    counters, moments = block.snapshot()
+    assert list(counters[:, 0]) == [len(events) / WORKERS] * WORKERS
+    file_name = str(tmp_path / "live.yoda")
+    live.export(block, counters, moments, file_name)
+    passed, results = compare_files(file_name, reference, normalize=False)
+    assert passed
+    assert sorted(results) == [
+        "/LL_JetRates/log10_y_{0}{1}".format(j, j + 1) for j in range(2, 6)
+    ]
+    for result in results.values():
+        assert result["chi2"] == pytest.approx(0., abs=1.e-12)
+    # only the exported file is left, without its temporary file
+    assert sorted(p.name for p in tmp_path.iterdir()) == \
+        ["analysis.yoda", "live.yoda"]
@@ -0,0 +1,97 @@
+import functools
+import threading
+
+import pytest
+
+import constants as const
+import integrate
+import pipeline
+from utils.alphas import AlphaS
+from utils.analysis import Analysis
+from utils.shower import Shower
+
+S = const.Z_MASS**2
+INTERVAL = [[0, const.pi], [-const.pi, const.pi]]
+# generous bound on a pipeline run, which hangs if a failure deadlocks it
+TIMEOUT = 60.
+
+class FailingShower:
+    """Shower stand-in that raises on the event after `events` events."""
+
+    def __init__(self, events=0):
+        self.events = events
+        self.weights = {}
+
+    def run(self, event, t):
+        if self.events == 0:
+            raise RuntimeError("shower failed")
+        self.events -= 1
+
+class FailingAnalysis(Analysis):
+
+    def analyze(self, event, weight, variation_weights=None):
+        raise RuntimeError("analysis failed")
+
+def run(**kwargs):
+    """Runs a small pipeline in a separate thread and returns its result or
+    raises its error. Fails if it does not finish within TIMEOUT."""
+    arguments = dict(
+        events=200,
+        shower_factory=functools.partial(
+            Shower, AlphaS(const.Z_MASS**2, const.QCD_COUPLING_Z_MASS)
+        ),
+        analysis=Analysis(),
+        interval=INTERVAL,
+        s=S,
+        batch_size=10,
+        workers=2,
+        queue_size=2
+    )
+    arguments.update(kwargs)
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = pipeline.run_pipeline(**arguments)
+        except BaseException as error:
+            outcome["error"] = error
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(TIMEOUT)
+    assert not thread.is_alive(), "pipeline did not finish"
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+def test_pipeline_analyzes_all_events():
+    analysis = Analysis()
+    result = run(analysis=analysis)
+    assert analysis.num_events == 200
+    assert result["shower"]["events"] == 200
+
+@pytest.mark.parametrize("processes", [False, True])
+@pytest.mark.parametrize("events", [0, 25])
+def test_shower_error_is_raised(processes, events):
+    with pytest.raises(RuntimeError, match="shower failed") as info:
+        run(
+            shower_factory=functools.partial(FailingShower, events),
+            processes=processes
+        )
+    assert isinstance(info.value.__cause__, pipeline.RemoteTraceback)
+    assert "shower_batches" in str(info.value.__cause__)
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_analysis_error_is_raised(processes):
+    with pytest.raises(RuntimeError, match="analysis failed"):
+        run(analysis=FailingAnalysis(), processes=processes)
+
+def test_generator_error_is_raised(monkeypatch):
+
+    def failing_generator(*args):
+        raise RuntimeError("generator failed")
+        yield
+
+    monkeypatch.setattr(integrate, "event_generator", failing_generator)
+    with pytest.raises(RuntimeError, match="generator failed"):
+        run()
@@ -0,0 +1,51 @@
+import functools
+
+import numpy as np
+import pytest
+
+import benchmark
+import integrate
+import scan
+
+def yoda_total(file_name, path):
+    """Returns the total sum of weights of the histogram `path` in a YODA
+    file."""
+    with open(file_name) as file:
+        lines = iter(file)
+        for line in lines:
+            if line.startswith("# BEGIN YODA_HISTO1D " + path):
+                break
+        for line in lines:
+            if line.startswith("Total"):
+                return float(line.split()[2])
+    raise ValueError("{0} not found.".format(path))
+
+def test_histograms_are_normalised_to_the_cross_section(tmp_path):
+    config = dict(
+        scan.DEFAULTS, events=50, samples=10_000, seed=1, code_version=""
+    )
+    result = scan.run_point(config, str(tmp_path))
+    # every event enters the y_23 histogram once, possibly in an outflow
+    total = yoda_total(result["yoda"], "/LL_JetRates/log10_y_23")
+    assert abs(total / result["cross_section"] - 1.) < 1.e-5
+
+@pytest.mark.parametrize("sqrt_s", [30., scan.DEFAULTS["sqrt_s"], 200.])
+def test_cross_section_matches_analytic_total(sqrt_s):
+    np.random.seed(3)
+    s = sqrt_s**2
+    result = integrate.integrate_streaming(
+        functools.partial(scan.diff_cross_section, s=s),
+        200_000,
+        functools.partial(
+            integrate.quark_scattering_process, interval=scan.INTERVAL
+        ),
+        scan.VOLUME_ELEMENT,
+        checkpoints=[]
+    )
+    exact = scan.total_cross_section(s)
+    assert abs(result.estimate - exact) < 5 * result.error
+    assert result.error < 1.e-2 * exact
+
+def test_import_does_not_load_scipy():
+    # the grid points run in worker processes, which import this module
+    assert benchmark.measure_imports(["scan"], repeat=1)["heavy_modules"] == []
@@ -0,0 +1,73 @@
+import math as m
+import random
+
+import numpy as np
+import pytest
+
+import constants as const
+import integrate
+from utils.alphas import AlphaS, ScaledAlphaS
+from utils.particle import Particle
+from utils.shower import Shower
+from utils.vector import Vec4
+
+S = const.Z_MASS**2
+INTERVAL = [[0, np.pi], [-np.pi, np.pi]]
+EVENTS = 4000
+T0 = 4.
+NOMINAL = AlphaS(S, const.QCD_COUPLING_Z_MASS)
+# upward variations, which the overestimate of the nominal coupling alone
+# does not bound
+VARIATIONS = {
+    "asmz": AlphaS(S, .13),
+    "mur": ScaledAlphaS(NOMINAL, .25),
+}
+
+def multiplicities(alphas, variations=None, seed=1):
+    """Returns the number of outgoing particles of each showered event and
+    the reweighting factors of each variation."""
+    random.seed(seed)
+    np.random.seed(seed)
+    shower = Shower(alphas, t0=T0, variations=variations)
+    numbers = []
+    weights = {name: [] for name in shower.variations}
+    for event in integrate.event_generator(EVENTS, INTERVAL, S):
+        shower.run(event, S)
+        numbers.append(len(event) - 2)
+        for name in weights:
+            weights[name].append(shower.weights[name])
+    return np.array(numbers), {
+        name: np.array(values) for name, values in weights.items()
+    }
+
+@pytest.fixture(scope="module")
+def reweighted():
+    return multiplicities(NOMINAL, VARIATIONS)
+
+@pytest.mark.parametrize("name", list(VARIATIONS))
+def test_reweighted_multiplicity_matches_direct_shower(reweighted, name):
+    numbers, weights = reweighted
+    w = weights[name]
+    assert w.min() > 0.
+    mean = np.sum(w * numbers) / np.sum(w)
+    error = m.sqrt(np.sum(w**2 * (numbers - mean)**2)) / np.sum(w)
+    direct, _ = multiplicities(VARIATIONS[name], seed=2)
+    direct_error = direct.std() / m.sqrt(len(direct))
+    assert abs(mean - direct.mean()) < 4. * m.hypot(error, direct_error)
+
+def test_make_kinematics_leaves_its_arguments_unchanged():
+    shower = Shower(NOMINAL)
+    pij = Vec4(10., 3., 4., 0.)
+    pk = Vec4(20., 0., 12., -16.)
+    pi, pj, pk_new = shower.make_kinematics(.3, .2, 1., pij, pk)
+    assert (pij.E, pij.px, pij.py, pij.pz) == (10., 3., 4., 0.)
+    assert (pk.E, pk.px, pk.py, pk.pz) == (20., 0., 12., -16.)
+    total = pi + pj + pk_new - pij - pk
+    assert max(abs(total[i]) for i in range(4)) < 1.e-12
+
+def test_particles_do_not_share_colors():
+    color = [1, 0]
+    first, second = Particle(1, Vec4(), color), Particle(1, Vec4(), color)
+    first.color[0] = 2
+    assert second.color == color == [1, 0]
+    assert Particle(21, Vec4()).color is not Particle(21, Vec4()).color
@@ -0,0 +1,52 @@
+import math as m
+import random
+
+import numpy as np
+import pytest
+
+import constants as const
+import integrate
+from utils.alphas import AlphaS, ScaledAlphaS
+from utils.analysis import Analysis
+from utils.shower import Shower
+
+S = const.Z_MASS**2
+INTERVAL = [[0, np.pi], [-np.pi, np.pi]]
+NOMINAL = AlphaS(S, const.QCD_COUPLING_Z_MASS)
+
+def observables(jit, events=3000, seed=1):
+    """Returns the number of outgoing particles of each showered event and
+    log10(y_23) of the events with at least three partons."""
+    random.seed(seed)
+    np.random.seed(seed)
+    shower = Shower(NOMINAL, jit=jit)
+    assert (shower.compiled is not None) == jit
+    analysis = Analysis()
+    numbers = []
+    log_y23 = []
+    for event in integrate.event_generator(events, INTERVAL, S):
+        shower.run(event, S)
+        numbers.append(len(event) - 2)
+        scales = analysis.cluster(event)
+        if scales:
+            log_y23.append(m.log10(scales[-1]))
+    return np.array(numbers), np.array(log_y23)
+
+def test_compiled_shower_matches_python():
+    pytest.importorskip("numba")
+    compiled = observables(True, seed=1)
+    python = observables(False, seed=2)
+    for a, b in zip(compiled, python):
+        error = m.hypot(a.std() / m.sqrt(len(a)), b.std() / m.sqrt(len(b)))
+        assert abs(a.mean() - b.mean()) < 4. * error
+
+@pytest.mark.parametrize(
+    "kwargs", [
+        dict(alphas=ScaledAlphaS(NOMINAL, 2.)),
+        dict(alphas=NOMINAL, variations={"up": ScaledAlphaS(NOMINAL, .5)}),
+    ]
+)
+def test_fallback_warns(kwargs):
+    with pytest.warns(RuntimeWarning, match="Python shower"):
+        shower = Shower(jit=True, **kwargs)
+    assert shower.compiled is None
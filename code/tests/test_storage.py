@@ -0,0 +1,94 @@
+import random
+
+import numpy as np
+import pytest
+
+import constants as const
+import integrate
+from utils.alphas import AlphaS
+from utils.analysis import Analysis
+from utils.shower import Shower
+from utils import storage
+
+S = const.Z_MASS**2
+INTERVAL = [[0, np.pi], [-np.pi, np.pi]]
+# relative precision of float32, i.e. the "about 7 significant digits" of the
+# compact mode
+FLOAT32_PRECISION = 2.**-24
+
+@pytest.fixture(scope="module")
+def events():
+    random.seed(4)
+    np.random.seed(4)
+    shower = Shower(AlphaS(S, const.QCD_COUPLING_Z_MASS), t0=1.)
+    events = list(integrate.event_generator(100, INTERVAL, S))
+    for event in events:
+        shower.run(event, S)
+    return events
+
+def components(event):
+    return np.array([(p.mom.E, p.mom.px, p.mom.py, p.mom.pz) for p in event])
+
+def test_full_mode_is_exact(events, tmp_path):
+    file_name = str(tmp_path / "events.npz")
+    storage.save_events(file_name, events)
+    stored = storage.load_events(file_name)
+    assert [[(p.pid, p.color) for p in event] for event in stored] == \
+        [[(p.pid, p.color) for p in event] for event in events]
+    for event, other in zip(events, stored):
+        np.testing.assert_array_equal(components(other), components(event))
+
+def test_compact_mode_keeps_the_documented_precision(events, tmp_path):
+    file_name = str(tmp_path / "events.npz")
+    storage.save_events(file_name, events, compact=True)
+    stored = storage.load_events(file_name)
+    assert [[(p.pid, p.color) for p in event] for event in stored] == \
+        [[(p.pid, p.color) for p in event] for event in events]
+    for event, other in zip(events, stored):
+        momenta = components(event)
+        scale = np.abs(momenta).max()
+        deviation = np.abs(components(other) - momenta).max()
+        assert deviation <= FLOAT32_PRECISION * scale
+        # each component of the momentum sum deviates by at most that of
+        # its particles
+        assert storage.momentum_residual(other) <= \
+            storage.momentum_residual(event) + \
+            len(event) * FLOAT32_PRECISION * scale
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_histograms_round_trip(events, tmp_path, compact):
+    analysis = Analysis(replicas=5, seed=1, correlations=True)
+    for event in events:
+        analysis.analyze(event, 1.)
+    analysis.flush()
+    histograms = [h for h, _, _ in analysis.observables]
+    file_name = str(tmp_path / "histograms.npz")
+    storage.save_histograms(file_name, histograms, compact)
+    loaded = storage.load_histograms(file_name)
+    rtol = FLOAT32_PRECISION if compact else 0.
+    assert [type(h) for h in loaded] == [type(h) for h in histograms]
+    for h, other in zip(histograms, loaded):
+        assert other.name == h.name
+        assert other.scaled_by == h.scaled_by
+        for edges, other_edges in zip(h.edges, other.edges):
+            np.testing.assert_array_equal(other_edges, edges)
+        counts = h.moments.index("numEntries")
+        np.testing.assert_array_equal(other.data[counts], h.data[counts])
+        np.testing.assert_allclose(other.data, h.data, rtol=rtol, atol=0.)
+        assert other.replicas is not None
+        np.testing.assert_allclose(
+            other.replicas, h.replicas, rtol=rtol, atol=0.
+        )
+
+def test_atomic_file_keeps_the_old_file_on_error(tmp_path):
+    file_name = str(tmp_path / "histograms.npz")
+    with storage.atomic_file(file_name) as temporary:
+        assert temporary.endswith(".npz")
+        np.savez(temporary, x=1)
+    with pytest.raises(RuntimeError):
+        with storage.atomic_file(file_name) as temporary:
+            np.savez(temporary, x=2)
+            raise RuntimeError
+    assert [p.name for p in tmp_path.iterdir()] == ["histograms.npz"]
+    with np.load(file_name) as data:
+        assert int(data["x"]) == 1
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+import constants as const
+from utils.alphas import AlphaS
+from utils.shower import Pqq, Shower
+from utils.sudakov import IntegralTable
+
+KERNELS = Shower(AlphaS(const.Z_MASS**2, const.QCD_COUPLING_Z_MASS)).kernels
+
+@pytest.mark.parametrize("t0", [1., 4.])
+def test_tables_bound_the_integrals(t0):
+    excess = IntegralTable(KERNELS, t0).validate()
+    assert set(excess) == {"Pqq", "Pgq", "Pgg"}
+    for values in excess.values():
+        assert np.all(values >= 0.)
+        # the integrals rise steeply only in the first octave
+        assert np.all(values[1:] < .02)
+        assert values[0] == values.max()
+
+def test_validate_rejects_an_underestimate():
+    table = IntegralTable(KERNELS, 1.)
+    values = dict(table.arrays)
+    values[Pqq] = values[Pqq] * (1. - 1.e-6)
+    with pytest.raises(ValueError, match="Pqq underestimates"):
+        IntegralTable(KERNELS, 1., values=values).validate()
+
+def test_cached_tables_are_reused(tmp_path):
+    first = IntegralTable.cached(KERNELS, 1., str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1
+    second = IntegralTable.cached(KERNELS, 1., str(tmp_path))
+    assert second.values == first.values
+    assert IntegralTable.cached(KERNELS, 4., str(tmp_path)).t0 == 4.
+    assert len(list(tmp_path.iterdir())) == 2
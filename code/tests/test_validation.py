@@ -0,0 +1,12 @@
+from utils.validation import check_shower
+
+def test_shower_matches_reference():
+    """The fixed-seed reduced sample of the current shower and analysis
+    reproduces the reference jet rate histograms."""
+    passed, results = check_shower()
+    failed = {
+        name: result["chi2_ndf"]
+        for name, result in results.items() if not result["passed"]
+    }
+    assert results
+    assert passed, "chi2/ndf above tolerance: {0}".format(failed)
@@ -72,3 +72,21 @@ class AlphaS:
     def __call__(self,t):
         if self.order == 0: return self.as0(t)
         return self.as1(t)
+
+class ScaledAlphaS:
+    """
+    Strong coupling evaluated at a renormalisation scale that is `factor`
+    times the scale it is called with, used for scale variations:
+
+      alphas = AlphaS(91.8**2, 0.118)
+      alphas_up = ScaledAlphaS(alphas, 4.)
+      print(alphas_up(100)) # alphas(400)
+
+    """
+
+    def __init__(self,alphas,factor):
+        self.alphas = alphas
+        self.factor = factor
+
+    def __call__(self,t):
+        return self.alphas(self.factor*t)
@@ -1,11 +1,13 @@
-import itertools
+import copy
 import math as m
+import os
 
-import constants as const
+import numpy as np
 
+from utils.jets import cluster as cluster_jets, y_ij
 from utils.vector import Vec4
 from utils.particle import Particle
-from utils.histogram import Histo1D, Scatter2D
+from utils.histogram import Histo1D, Histo2D, Profile1D, Scatter2D
 
 class Analysis:
     """Analyzer of 2->(n jet) scattering events, histogramming differential jet
@@ -14,12 +16,40 @@ class Analysis:
       d\\sigma / d\\log_10(y_{n,n+1})
 
     for various n. The integrated n-jet rates are also calculated and stored as
-    scatter data.
+    scatter data. Correlations between the observables can be accumulated in
+    multi-dimensional histograms, see `book`.
+
+    Optionally, all histograms carry Poisson bootstrap replicas of the sum of
+    weights, from which the uncertainties of normalised or derived quantities,
+    e.g. the integrated jet rates, are obtained in a single run.
     """
 
-    def __init__(self):
+    # number of entries buffered per multi-dimensional histogram before they
+    # are filled in bulk
+    buffer_size = 1024
+
+    def __init__(
+        self, variations=(), replicas=0, seed=None, correlations=False
+    ):
+        """Books the histograms. For each name in `variations`, e.g. the keys
+        of the `variations` of a `Shower`, an additional set of histograms is
+        booked and filled with the reweighted events.
+
+        With `replicas` > 0, each event gets that many weights drawn from a
+        Poisson distribution of mean 1, using a generator seeded with `seed`,
+        which are filled into the bootstrap replicas of all histograms. The
+        errors of the integrated jet rates are then set from the spread of the
+        replicas.
+
+        With `correlations=True`, a Histo2D of the subsequent splitting scales
+        y_23 and y_34 and a Profile1D of the mean multiplicity in y_23 are
+        booked in addition to the jet rates."""
 
         self.num_events = 0.
+        self.replicas = replicas
+        self.replica_events = np.zeros(replicas)
+        self.rng = np.random.default_rng(seed)
+        self.live = None
 
         # Construct list of histograms for the differential jet rates up to
         # y_{n_max,n_max+1} and for the corresponding integrated jet rates.
@@ -32,7 +62,8 @@ class Analysis:
                 n_bins,
                 self.left_edge,
                 self.right_edge,
-                '/LL_JetRates/log10_y_{0}{1}'.format(i + 2, i + 3)
+                '/LL_JetRates/log10_y_{0}{1}'.format(i + 2, i + 3),
+                replicas
             ) for i in range(n_max)
         ]
         self.y_n_integrated = [
@@ -40,25 +71,139 @@ class Analysis:
                 n_bins,
                 self.left_edge,
                 self.right_edge,
-                '/LL_JetRates/integ_log10_y_{0}'.format(i + 2)
+                '/LL_JetRates/integ_log10_y_{0}'.format(i + 2),
+                replicas
             ) for i in range(n_max + 1)
         ]
+        self.variations = {}
+
+        self.observables = []
+        if correlations:
+            # Book multi-dimensional histograms of the correlation between
+            # subsequent splitting scales and of the mean final-state
+            # multiplicity as a function of the 2 -> 3 jet splitting scale.
+            n_bins_2d = 40
+            self.book(
+                Histo2D(
+                    n_bins_2d,
+                    self.left_edge,
+                    self.right_edge,
+                    n_bins_2d,
+                    self.left_edge,
+                    self.right_edge,
+                    '/LL_JetRates/log10_y_23_vs_log10_y_34',
+                    replicas
+                ),
+                lambda y_ij_list: (
+                    self.log_y(y_ij_list, 0), self.log_y(y_ij_list, 1)
+                )
+            )
+            self.book(
+                Profile1D(
+                    n_bins,
+                    self.left_edge,
+                    self.right_edge,
+                    '/LL_JetRates/multiplicity_vs_log10_y_23',
+                    replicas
+                ),
+                lambda y_ij_list: (
+                    self.log_y(y_ij_list, 0), len(y_ij_list) + 2
+                )
+            )
+
+        self.variations = {
+            name: Analysis(replicas=replicas, correlations=correlations)
+            for name in variations
+        }
+
+    def share(self, slot):
+        """Mirrors the differential jet rate histograms and the event count
+        into `slot`, a `utils.live.LiveSlot` of a shared memory block, so
+        that a monitor process can follow the run, see `utils.live`. Call it
+        before the first event. The variations are not shared."""
+        if slot.moments.shape[0] != len(self.y_n) or \
+           slot.moments.shape[2] != len(self.y_n[0].bins) + 2:
+            raise ValueError("The slot does not match the histograms.")
+        slot.start()
+        for h, moments in zip(self.y_n, slot.moments):
+            h.share(moments)
+        self.live = slot
+
+    def book(self, histogram, observable):
+        """Books a multi-dimensional `histogram`, e.g. a Histo2D or a
+        Profile1D, which is filled with the coordinates returned by
+        `observable(y_ij_list)` for the splitting scales of each event. The
+        entries are buffered and filled in bulk, so that the memory used does
+        not grow with the number of events. If the histogram has replicas, it
+        is filled with the replica weights of the events."""
+        self.observables.append((histogram, observable, []))
+        for analysis in self.variations.values():
+            analysis.book(copy.deepcopy(histogram), observable)
 
-    def analyze(self, event, weight):
+    def flush(self):
+        """Fills the buffered entries into the multi-dimensional
+        histograms."""
+        for histogram, _, buffer in self.observables:
+            if buffer:
+                entries = list(zip(*buffer))
+                if self.replicas:
+                    histogram.fill_array(
+                        entries[:-2], entries[-2], np.array(entries[-1])
+                    )
+                else:
+                    histogram.fill_array(entries[:-1], entries[-1])
+                buffer.clear()
+
+    def log_y(self, y_ij_list, j):
+        """Returns log10 of the j-th largest splitting scale, or a value
+        below the histogram range if the event has too few of them."""
+        if len(y_ij_list) > j:
+            return m.log10(y_ij_list[-1 - j])
+        return self.left_edge - 1
+
+    def analyze(self, event, weight, variation_weights=None):
         """Adds a single event (= list of Particle instances)
-        with corresponding Monte-Carlo weight to the histograms."""
+        with corresponding Monte-Carlo weight to the histograms. The
+        histograms of the variations are filled with the weight multiplied by
+        the respective entry of `variation_weights`, e.g. the `weights` of the
+        `Shower` after showering the event, which are required if variations
+        are booked."""
+
+        if self.variations and variation_weights is None:
+            raise ValueError(
+                "The variations {0} need variation_weights.".format(
+                    ", ".join(self.variations)
+                )
+            )
+        y_ij_list = self.cluster(event)
+        replica_weights = None
+        if self.replicas:
+            replica_weights = self.rng.poisson(1., self.replicas)
+        self.fill(y_ij_list, weight, replica_weights)
+        for name, analysis in self.variations.items():
+            analysis.fill(
+                y_ij_list, weight * variation_weights[name], replica_weights
+            )
+
+    def fill(self, y_ij_list, weight, replica_weights=None):
+        """Adds the splitting scales `y_ij_list` of a single event, as returned
+        by `cluster`, with corresponding Monte-Carlo weight to the
+        histograms, and to their replicas multiplied by `replica_weights`."""
 
         self.num_events += 1.
+        if self.live is not None:
+            self.live.count(weight)
+        if self.replicas:
+            self.replica_events += replica_weights
 
         # Fill differential j -> (j+1) splitting scale distributions if there
         # have not been a sufficient number of to cluster, we add the event to
         # the underflow of the histogram.
-        y_ij_list = self.cluster(event)
         for j in range(len(self.y_n)):
             log_y = self.left_edge - 1
             if len(y_ij_list) > j:
                 log_y = m.log10(y_ij_list[-1 - j])
-            self.y_n[j].fill(log_y, weight)
+            self.y_n[j].fill(log_y, weight, replica_weights)
 
         # Fill integrated j-jet rates.
         previous_logy = 1e20
@@ -67,85 +212,95 @@ class Analysis:
             log_y = self.left_edge - 1
             if len(y_ij_list) > j:
                 log_y = m.log10(y_ij_list[-1 - j])
-            for p in j_jet_rate.points:
-                if p.x > log_y and p.x < previous_logy:
-                    p.y += weight
+            j_jet_rate.fill_range(log_y, previous_logy, weight, replica_weights)
             previous_logy = log_y
-        for p in self.y_n_integrated[-1].points:
-            if p.x < previous_logy:
-                p.y += weight
+        self.y_n_integrated[-1].fill_range(
+            -float("inf"), previous_logy, weight, replica_weights
+        )
+
+        # Buffer the entries of the multi-dimensional histograms.
+        for _, observable, buffer in self.observables:
+            if self.replicas:
+                buffer.append((*observable(y_ij_list), weight, replica_weights))
+            else:
+                buffer.append((*observable(y_ij_list), weight))
+            if len(buffer) >= self.buffer_size:
+                self.flush()
 
     def finalize(self, file_name):
         """Scales the histograms properly and writes them out as a YODA file
-        with the given file_name."""
+        with the given file_name. The histograms of each variation are written
+        to a separate file, whose name is extended by the variation name, e.g.
+        `analysis_muR2.yoda` for the variation `muR2` of `analysis.yoda`."""
 
         # Divide out the number of events to get the correct cross section.
+        self.flush()
         for h in self.y_n:
             h.scale(1. / self.num_events)
         for s in self.y_n_integrated:
             s.scale(1. / self.num_events)
+        for h, _, _ in self.observables:
+            h.scale(1. / self.num_events)
+
+        # Normalise each replica to its own number of events, so that the
+        # spread of the replicas includes that of the normalisation.
+        if self.replicas:
+            factors = self.num_events / self.replica_events
+            for h in self.y_n + [h for h, _, _ in self.observables]:
+                if h.replicas is not None:
+                    h.scale_replicas(factors)
+            for s in self.y_n_integrated:
+                s.scale_replicas(factors)
+                s.bootstrap_errors()
 
         # Write the histograms to a YODA file.
         file = open(file_name, "w")
         file.write("\n\n".join([str(h) for h in self.y_n]))
         file.write("\n\n")
         file.write("\n\n".join([str(s) for s in self.y_n_integrated]))
+        for h, _, _ in self.observables:
+            file.write("\n\n")
+            file.write(str(h))
         file.close()
 
+        root, ext = os.path.splitext(file_name)
+        for name, analysis in self.variations.items():
+            analysis.finalize("{0}_{1}{2}".format(root, name, ext))
+
     def y_ij(self, p_i: Vec4, p_j: Vec4, q2: float) -> float:
         """Calculates the k_T-algorithm distance measure between four momenta
-        p_i and p_j, and the reference scale Q^2"""
-        pipj = p_i.px * p_j.px + p_i.py * p_j.py + p_i.pz * p_j.pz
-        cos_theta = min(
-            max(
-                pipj /
-                m.sqrt(p_i.length_3d_squared() * p_j.length_3d_squared()),
-                -1.0
-            ),
-            1.0
-        )
-        return 2.0 * min(p_i.E**2, p_j.E**2) * (1.0 - cos_theta) / q2
+        p_i and p_j, and the reference scale Q^2, see `utils.jets.y_ij`."""
+        return y_ij(p_i, p_j, q2)
+
+    def q2(self, event: list[Particle]) -> float:
+        """Returns the reference scale Q^2 of the jet measure, the invariant
+        mass of the two incoming particles event[:2], i.e. the squared
+        centre-of-mass energy s of the event."""
+        return (event[0].mom + event[1].mom).invariant_mass_squared()
 
     def cluster(self, event: list[Particle]):
         """Applies the k_T clustering algorithm to an event (= list of
         Particle instances). A y_cut is not used, i.e. the clustering continues
         until only two jets are left.
 
-        Returns a list of splitting scales y_ij, ordered from smallest y_ij to
-        largest y_ij.
+        Returns a list of splitting scales y_ij, in the order they were
+        clustered, i.e. from smallest y_ij to largest y_ij.
         """
-        # TODO: Implement the k_T clustering algorithm described in
-        # the lecture here, and return all found splitting scales y_ij as a
-        # list, ordered from smallest y_ij to largest y_ij.
-
-        # NOTE: There is no fixed y_cut, since we want to know at which point a
-        # n-jet event starts looking like a (n+1)-jet event for a range of
-        # different n (compare the kT jet fraction plot in the lecture, which
-        # is a sort of integrated version of what we'd like to plot). Instead,
-        # keep clustering until only two jets are left.
-
-        # NOTE: The y_ij distance measure is already implemented, see above.
-        # As a reference scale Q^2, use the invariant mass of two incoming (or
-        # two outgoing) particles, which in our case will be equal the squared
-        # Z mass.
-
-        final_state_momenta = list(map(lambda part: part.mom, event[2:]))
-
-        split_scales = []
-        while len(final_state_momenta) > 2:
-            distances = map(
-                lambda moment: (
-                    self.y_ij(moment[0][1], moment[1][1], const.Z_MASS**2),
-                    moment[0][0],
-                    moment[1][0]
-                ),
-                itertools.combinations(enumerate(final_state_momenta), 2)
-            )
-
-            min_distance, idx1, idx2 = min(distances, key=lambda x, *_: x)
-            mom_combine = final_state_momenta.pop(max(idx1, idx2))
-            final_state_momenta[min(idx1, idx2)] += mom_combine
+        # NOTE: As a reference scale Q^2, the invariant mass of the two
+        # incoming particles is used, see `q2`, so that the scales are also
+        # correct away from the Z pole.
+        return cluster_jets(
+            [p.mom for p in event[2:]], self.q2(event), n_jets=2
+        ).scales
 
-            split_scales.append(min_distance)
-
-        return split_scales
+    def exclusive_jets(self, event: list[Particle], y_cut: float, **kwargs):
+        """Returns the exclusive jets of an event (= list of Particle
+        instances) at the given `y_cut` as a `utils.jets.ClusterSequence`,
+        holding the jet momenta, the assignment of the final-state particles
+        event[2:] to the jets and the splitting scales below `y_cut`. The
+        clustering stops as soon as all y_ij exceed `y_cut`. Further keyword
+        arguments, e.g. `algorithm` or `scheme`, are passed to
+        `utils.jets.cluster`."""
+        return cluster_jets(
+            [p.mom for p in event[2:]], self.q2(event), y_cut=y_cut, **kwargs
+        )
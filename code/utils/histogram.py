@@ -1,4 +1,7 @@
 import sys
+from abc import ABC, abstractmethod
+
+import numpy as np
 
 """This file reimplements the relevant classes of the YODA histogramming
 framework."""
@@ -66,7 +69,10 @@ class Point2D:
 class Histo1D:
     """A 1D histogram."""
 
-    def __init__(self,nbin,xmin,xmax,name="/MC/untitled"):
+    def __init__(self,nbin,xmin,xmax,name="/MC/untitled",replicas=0,seed=None):
+        """With `replicas` > 0, the sum of weights of `replicas` bootstrap
+        replicas is kept for each bin in `self.replicas`, with the underflow
+        first and the overflow last, see `fill`."""
         self.name = name
         self.bins = []
         self.uflow = Bin1D(-sys.float_info.max,xmin)
@@ -76,6 +82,9 @@ class Histo1D:
         self.oflow = Bin1D(xmax,sys.float_info.max)
         self.total = Bin1D(-sys.float_info.max,sys.float_info.max)
         self.scaled_by = 1.
+        self.replicas = np.zeros((replicas,nbin+2)) if replicas else None
+        self.rng = np.random.default_rng(seed) if replicas else None
+        self.live = None
 
     def __repr__(self):
         return str(self)
@@ -95,8 +104,10 @@ class Histo1D:
         s += "# END YODA_HISTO1D\n"
         return s
 
-    def fill(self,x,w):
-        """Fill a single point of weight w at a given x coordinate."""
+    def fill(self,x,w,replica_weights=None):
+        """Fill a single point of weight w at a given x coordinate. The
+        replicas are filled with w times their entry of `replica_weights`,
+        which are drawn from a Poisson distribution of mean 1 if not given."""
         l = 0
         r = len(self.bins)-1
         c = (l+r)//2
@@ -108,11 +119,35 @@ class Histo1D:
             a = self.bins[c].xmin
         if x > self.bins[r].xmin:
             self.oflow.fill(x,w)
+            i = len(self.bins)+1
         elif x < self.bins[l].xmin:
             self.uflow.fill(x,w)
+            i = 0
         else:
             self.bins[l].fill(x,w)
+            i = l+1
         self.total.fill(x,w)
+        if self.replicas is not None:
+            if replica_weights is None:
+                replica_weights = self.rng.poisson(1.,len(self.replicas))
+            self.replicas[:,i] += w*np.asarray(replica_weights)
+        if self.live is not None:
+            live = self.live
+            live[0,i] += w
+            live[1,i] += w*w
+            live[2,i] += w*x
+            live[3,i] += w*w*x
+            live[4,i] += 1.
+
+    def share(self,moments):
+        """Keeps a copy of the bin contents in the array `moments` of shape
+        (5, nbin+2), e.g. a view into shared memory, with the moments of
+        ArrayHisto1D along the first axis and the underflow first and the
+        overflow last along the second axis. The current contents are copied
+        and all later fills are added to it, but scaling is not applied."""
+        for i,b in enumerate([self.uflow]+self.bins+[self.oflow]):
+            moments[:,i] = (b.w,b.w2,b.wx,b.wx2,b.n)
+        self.live = moments
 
     def scale(self,factor):
         """Scale histogram weights (i.e. bin heights) by `factor`."""
@@ -121,8 +156,19 @@ class Histo1D:
         self.oflow.scale(factor)
         for i in range(len(self.bins)):
             self.bins[i].scale(factor)
+        if self.replicas is not None:
+            self.replicas *= factor
         self.scaled_by = factor
 
+    def scale_replicas(self,factors):
+        """Scales each replica by its entry of `factors`."""
+        self.replicas *= np.asarray(factors)[:,None]
+
+    def bootstrap_errors(self):
+        """Returns the standard deviation of the replicas for each bin,
+        without the outflows."""
+        return np.std(self.replicas[:,1:-1],axis=0,ddof=1)
+
     def plot(self):
         """Plots the histogram using the matplotlib library."""
         import matplotlib.pyplot as plt
@@ -134,13 +180,18 @@ class Histo1D:
 
 class Scatter2D:
 
-    def __init__(self,npoints,xmin,xmax,name="/MC/untitled"):
+    def __init__(self,npoints,xmin,xmax,name="/MC/untitled",replicas=0,seed=None):
+        """With `replicas` > 0, the y values of `replicas` bootstrap replicas
+        are kept in `self.replicas` as well, see `fill_range`."""
         self.name = name
         self.points = []
         width = (xmax-xmin)/npoints
         for i in range(npoints):
             self.points.append(Point2D(xmin+i*width,xmin+(i+1)*width))
         self.scaled_by = 1.
+        self.x = np.array([p.x for p in self.points])
+        self.replicas = np.zeros((replicas,npoints)) if replicas else None
+        self.rng = np.random.default_rng(seed) if replicas else None
 
     def __repr__(self):
         return str(self)
@@ -155,8 +206,261 @@ class Scatter2D:
         s += "# END YODA_SCATTER2D\n"
         return s
 
+    def fill_range(self,xlow,xhigh,w,replica_weights=None):
+        """Adds w to the y values of all points with xlow < x < xhigh. The
+        replicas get w times their entry of `replica_weights`, which are
+        drawn from a Poisson distribution of mean 1 if not given."""
+        for p in self.points:
+            if p.x > xlow and p.x < xhigh:
+                p.y += w
+        if self.replicas is not None:
+            if replica_weights is None:
+                replica_weights = self.rng.poisson(1.,len(self.replicas))
+            mask = (self.x > xlow) & (self.x < xhigh)
+            self.replicas[:,mask] += w*np.asarray(replica_weights)[:,None]
+
     def scale(self,factor):
         """Scales the y coordinates by `factor`."""
         for i in range(len(self.points)):
             self.points[i].scale(factor)
+        if self.replicas is not None:
+            self.replicas *= factor
+        self.scaled_by = factor
+
+    def scale_replicas(self,factors):
+        """Scales each replica by its entry of `factors`."""
+        self.replicas *= np.asarray(factors)[:,None]
+
+    def bootstrap_errors(self):
+        """Sets the y errors of all points to the standard deviation of the
+        replicas and returns them."""
+        errors = np.std(self.replicas,axis=0,ddof=1)
+        for p,err in zip(self.points,errors.tolist()):
+            p.yerr = [err]*2
+        return errors
+
+
+class ArrayHistogram(ABC):
+    """Base class of histograms that store the moments of all bins, including
+    the under- and overflows, in a single numpy array `data`, whose first
+    axis runs over the `moments`. Derived classes set the `moments`, their
+    power of the weight in `weight_powers`, and the bin `edges` per axis.
+
+    With `replicas` > 0, the moments listed in `replica_moments`, which have
+    to be linear in the weight, are also kept for `replicas` bootstrap
+    replicas in the array `replicas` of shape
+    (len(replica_moments), replicas) + data.shape[1:]."""
+
+    moments = ()
+    weight_powers = ()
+    replica_moments = (0,)
+
+    def __init__(self,edges,name,replicas=0,seed=None):
+        self.name = name
+        self.edges = [np.array(e,dtype=float) for e in edges]
+        shape = tuple(len(e)+1 for e in self.edges)
+        self.data = np.zeros((len(self.moments),)+shape)
+        self.scaled_by = 1.
+        self.replicas = None
+        self.rng = None
+        if replicas:
+            self.replicas = np.zeros((len(self.replica_moments),replicas)+shape)
+            self.rng = np.random.default_rng(seed)
+
+    def __repr__(self):
+        return str(self)
+
+    def index(self,coords):
+        """Returns the flat bin indices of the points `coords`, one array per
+        axis. Index 0 is the underflow and len(edges) the overflow."""
+        shape = self.data.shape[1:]
+        flat = np.zeros(np.shape(coords[0]),dtype=np.intp)
+        for edges,x,n in zip(self.edges,coords,shape):
+            flat = flat*n+np.searchsorted(edges,x,side="right")
+        return flat
+
+    @abstractmethod
+    def values(self,coords,w):
+        """Returns the contributions of points `coords` with weights `w` to
+        the `moments`, as arrays of the same order."""
+
+    def fill_array(self,coords,w=1.,replica_weights=None):
+        """Fills many points at once, given as one array per axis in `coords`
+        with weights `w`. The replicas are filled with the weights multiplied
+        by `replica_weights`, an array of shape (points, replicas), which are
+        drawn from a Poisson distribution of mean 1 if not given."""
+        coords = [np.asarray(x,dtype=float).ravel() for x in coords]
+        w = np.broadcast_to(np.asarray(w,dtype=float),coords[0].shape)
+        flat = self.index(coords)
+        size = self.data[0].size
+        values = self.values(coords,w)
+        for moment,value in zip(self.data,values):
+            moment += np.bincount(flat,weights=value,minlength=size).reshape(moment.shape)
+        if self.replicas is not None:
+            k = self.replicas.shape[1]
+            if replica_weights is None:
+                replica_weights = self.rng.poisson(1.,(len(flat),k))
+            replica_weights = np.asarray(replica_weights,dtype=float)
+            # one bincount over the combined (replica, bin) index
+            index = (np.arange(k)*size+flat[:,None]).ravel()
+            for moment,m in zip(self.replicas,self.replica_moments):
+                moment += np.bincount(index,weights=(values[m][:,None]*replica_weights).ravel(),
+                                      minlength=k*size).reshape(moment.shape)
+
+    def merge(self,other):
+        """Adds the content of another histogram with identical binning."""
+        if len(self.edges) != len(other.edges) or \
+           not all(np.array_equal(a,b) for a,b in zip(self.edges,other.edges)):
+            raise ValueError("Cannot merge histograms with different binnings.")
+        if (self.replicas is None) != (other.replicas is None) or \
+           (self.replicas is not None and self.replicas.shape != other.replicas.shape):
+            raise ValueError("Cannot merge histograms with different replicas.")
+        self.data += other.data
+        if self.replicas is not None:
+            self.replicas += other.replicas
+
+    def scale(self,factor):
+        """Scale histogram weights (i.e. bin heights) by `factor`."""
+        for moment,power in zip(self.data,self.weight_powers):
+            moment *= factor**power
+        if self.replicas is not None:
+            self.replicas *= factor
         self.scaled_by = factor
+
+    def scale_replicas(self,factors):
+        """Scales each replica by its entry of `factors`."""
+        self.replicas *= np.reshape(factors,(-1,)+(1,)*len(self.edges))
+
+    def bootstrap_errors(self,moment=0):
+        """Returns the standard deviation of the replicas of the moment with
+        index `moment` for each bin, including the outflows."""
+        return np.std(self.replicas[self.replica_moments.index(moment)],axis=0,ddof=1)
+
+    def format_row(self,values):
+        return "\t".join("{0:10.6e}".format(v) for v in values[:-1]) + \
+            "\t{0}".format(int(values[-1]))
+
+class ArrayHisto1D(ArrayHistogram):
+    """A 1D histogram with array storage, written in the same format as
+    Histo1D."""
+
+    moments = ("sumw","sumw2","sumwx","sumwx2","numEntries")
+    weight_powers = (1,2,1,1,0)
+
+    def __init__(self,nbin,xmin,xmax,name="/MC/untitled",replicas=0,seed=None):
+        super().__init__([np.linspace(xmin,xmax,nbin+1)],name,replicas,seed)
+
+    def __str__(self):
+        s = "# BEGIN YODA_HISTO1D {0}\n".format(self.name)
+        s += "Path={0}\n".format(self.name)
+        s += "ScaledBy={0}\n".format(self.scaled_by)
+        s += "Title=\nType=Histo1D\n"
+        s += "# ID\tID\t"+"\t".join(self.moments)+"\n"
+        s += "Total\tTotal\t"+self.format_row(self.data.sum(axis=1))+"\n"
+        s += "Underflow\tUnderflow\t"+self.format_row(self.data[:,0])+"\n"
+        s += "Overflow\tOverflow\t"+self.format_row(self.data[:,-1])+"\n"
+        s += "# xlow\txhigh\t"+"\t".join(self.moments)+"\n"
+        edges = self.edges[0]
+        for i in range(len(edges)-1):
+            s += "{0:10.6e}\t{1:10.6e}\t".format(edges[i],edges[i+1])
+            s += self.format_row(self.data[:,i+1])+"\n"
+        s += "# END YODA_HISTO1D\n"
+        return s
+
+    def fill(self,x,w):
+        """Fill a single point of weight w at a given x coordinate."""
+        self.fill_array([[x]],w)
+
+    def values(self,coords,w):
+        x, = coords
+        return (w,w*w,w*x,w*x*x,np.ones_like(w))
+
+class Histo2D(ArrayHistogram):
+    """A 2D histogram with array storage."""
+
+    moments = ("sumw","sumw2","sumwx","sumwx2","sumwy","sumwy2","sumwxy","numEntries")
+    weight_powers = (1,2,1,1,1,1,1,0)
+
+    def __init__(self,nbinx,xmin,xmax,nbiny,ymin,ymax,name="/MC/untitled",replicas=0,seed=None):
+        super().__init__([np.linspace(xmin,xmax,nbinx+1),
+                          np.linspace(ymin,ymax,nbiny+1)],name,replicas,seed)
+
+    def __str__(self):
+        s = "# BEGIN YODA_HISTO2D {0}\n".format(self.name)
+        s += "Path={0}\n".format(self.name)
+        s += "ScaledBy={0}\n".format(self.scaled_by)
+        s += "Title=\nType=Histo2D\n"
+        s += "# ID\tID\t"+"\t".join(self.moments)+"\n"
+        s += "Total\tTotal\t"+self.format_row(self.data.sum(axis=(1,2)))+"\n"
+        s += "# 2D outflow persistency not currently supported until API is stable\n"
+        s += "# xlow\txhigh\tylow\tyhigh\t"+"\t".join(self.moments)+"\n"
+        xedges,yedges = self.edges
+        for i in range(len(xedges)-1):
+            for j in range(len(yedges)-1):
+                s += "{0:10.6e}\t{1:10.6e}\t{2:10.6e}\t{3:10.6e}\t".format\
+                    (xedges[i],xedges[i+1],yedges[j],yedges[j+1])
+                s += self.format_row(self.data[:,i+1,j+1])+"\n"
+        s += "# END YODA_HISTO2D\n"
+        return s
+
+    def fill(self,x,y,w):
+        """Fill a single point of weight w at given x and y coordinates."""
+        self.fill_array([[x],[y]],w)
+
+    def values(self,coords,w):
+        x,y = coords
+        return (w,w*w,w*x,w*x*x,w*y,w*y*y,w*x*y,np.ones_like(w))
+
+class Profile1D(ArrayHistogram):
+    """A 1D profile histogram with array storage, i.e. a histogram in x that
+    keeps track of the mean and spread of a second variable y in each bin."""
+
+    moments = ("sumw","sumw2","sumwx","sumwx2","sumwy","sumwy2","numEntries")
+    weight_powers = (1,2,1,1,1,1,0)
+    # sumw and sumwy, to propagate the replicas to the mean
+    replica_moments = (0,4)
+
+    def __init__(self,nbin,xmin,xmax,name="/MC/untitled",replicas=0,seed=None):
+        super().__init__([np.linspace(xmin,xmax,nbin+1)],name,replicas,seed)
+
+    def __str__(self):
+        s = "# BEGIN YODA_PROFILE1D {0}\n".format(self.name)
+        s += "Path={0}\n".format(self.name)
+        s += "ScaledBy={0}\n".format(self.scaled_by)
+        s += "Title=\nType=Profile1D\n"
+        s += "# ID\tID\t"+"\t".join(self.moments)+"\n"
+        s += "Total\tTotal\t"+self.format_row(self.data.sum(axis=1))+"\n"
+        s += "Underflow\tUnderflow\t"+self.format_row(self.data[:,0])+"\n"
+        s += "Overflow\tOverflow\t"+self.format_row(self.data[:,-1])+"\n"
+        s += "# xlow\txhigh\t"+"\t".join(self.moments)+"\n"
+        edges = self.edges[0]
+        for i in range(len(edges)-1):
+            s += "{0:10.6e}\t{1:10.6e}\t".format(edges[i],edges[i+1])
+            s += self.format_row(self.data[:,i+1])+"\n"
+        s += "# END YODA_PROFILE1D\n"
+        return s
+
+    def fill(self,x,y,w):
+        """Fill a single value y of weight w at a given x coordinate."""
+        self.fill_array([[x],[y]],w)
+
+    def index(self,coords):
+        return super().index(coords[:1])
+
+    def values(self,coords,w):
+        x,y = coords
+        return (w,w*w,w*x,w*x*x,w*y,w*y*y,np.ones_like(w))
+
+    def mean(self):
+        """Returns the weighted mean of y in each bin, without outflows."""
+        sumw = self.data[0,1:-1]
+        with np.errstate(divide='ignore',invalid='ignore'):
+            return np.where(sumw != 0,self.data[4,1:-1]/sumw,0.)
+
+    def mean_errors(self):
+        """Returns the standard deviation of the weighted mean of y over the
+        replicas in each bin, without outflows."""
+        sumw,sumwy = self.replicas[:,:,1:-1]
+        with np.errstate(divide='ignore',invalid='ignore'):
+            means = np.where(sumw != 0,sumwy/sumw,0.)
+        return np.std(means,axis=0,ddof=1)
@@ -0,0 +1,190 @@
+"""This file implements exclusive k_T-type jet clustering of final-state
+momenta for e+e- collisions, with the Durham and the Cambridge algorithm and
+several recombination schemes."""
+
+import math as m
+
+from utils.vector import Vec4
+
+ALGORITHMS = ("durham", "cambridge")
+SCHEMES = ("E", "E0", "P")
+
+class ClusterSequence:
+    """Result of `cluster`.
+
+    `scales` holds the y_ij of all recombinations in the order they were
+    performed, `jets` the four momenta of the jets left when the clustering
+    stopped and `assignment` the index of the jet in `jets` each input
+    momentum ended up in.
+    """
+
+    def __init__(self, scales, jets, assignment):
+        self.scales = scales
+        self.jets = jets
+        self.assignment = assignment
+
+    def __repr__(self):
+        return "ClusterSequence({0} jets, {1} scales)".format(
+            len(self.jets), len(self.scales)
+        )
+
+    def constituents(self, jet):
+        """Returns the indices of the input momenta clustered into the jet
+        with index `jet`."""
+        return [i for i, k in enumerate(self.assignment) if k == jet]
+
+def recombine(p, q, scheme="E"):
+    """Combines two momenta according to the recombination `scheme`: "E"
+    adds the four momenta, "E0" rescales the 3-momentum of the sum to make it
+    massless and "P" sets the energy of the sum to the length of its
+    3-momentum."""
+    s = p + q
+    if scheme == "E":
+        return s
+    length = s.length_3d()
+    if scheme == "E0":
+        f = s.E / length if length > 0. else 0.
+        return Vec4(s.E, f * s.px, f * s.py, f * s.pz)
+    if scheme == "P":
+        return Vec4(length, s.px, s.py, s.pz)
+    raise ValueError("Unknown recombination scheme {0}.".format(scheme))
+
+def cluster(momenta, q2, y_cut=None, n_jets=1, algorithm="durham", scheme="E"):
+    """Clusters the four momenta `momenta` (Vec4 instances) with the Durham
+    or the Cambridge `algorithm`, using the distance measure
+
+      y_ij = 2 min(E_i^2, E_j^2) (1 - cos theta_ij) / `q2`
+
+    and the recombination `scheme`, see `recombine`.
+
+    The Durham algorithm recombines the pair with the smallest y_ij until
+    either only `n_jets` jets are left or, if `y_cut` is given, all y_ij
+    exceed it. Stopping early saves the remaining recombinations, e.g. if only
+    the exclusive jets at a fixed `y_cut` are needed. Since each step only
+    updates the distances involving the recombined jet, a full clustering
+    takes O(n^2) distance evaluations.
+
+    The Cambridge algorithm needs a `y_cut`. It considers the pairs in order
+    of their angle and recombines them if y_ij < y_cut, otherwise the softer
+    of the two is frozen as a jet, until `n_jets` unfrozen jets are left.
+
+    Returns a `ClusterSequence`."""
+    if algorithm not in ALGORITHMS:
+        raise ValueError("Unknown clustering algorithm {0}.".format(algorithm))
+    if scheme not in SCHEMES:
+        raise ValueError("Unknown recombination scheme {0}.".format(scheme))
+    jets = list(momenta)
+    # jets are only deactivated, so that the indices stay valid
+    active = list(range(len(jets)))
+    owner = list(range(len(jets)))
+    if algorithm == "cambridge":
+        if y_cut is None:
+            raise ValueError("The Cambridge algorithm needs a y_cut.")
+        scales, frozen = _cluster_cambridge(
+            jets, active, owner, q2, y_cut, n_jets, scheme
+        )
+    else:
+        scales = _cluster_durham(jets, active, owner, q2, y_cut, n_jets, scheme)
+        frozen = []
+    final = frozen + active
+    index = {k: i for i, k in enumerate(final)}
+    return ClusterSequence(
+        scales, [jets[k] for k in final], [index[k] for k in _resolve(owner)]
+    )
+
+def _resolve(owner):
+    """Follows the recombination links in `owner` to the final jet of each
+    input momentum."""
+    final = []
+    for i in range(len(owner)):
+        while owner[i] != i:
+            i = owner[i]
+        final.append(i)
+    return final
+
+def _distances(jets, i, js, q2):
+    """Returns y_ij and 1 - cos(theta_ij) between jet `i` and the jets `js`."""
+    p = jets[i]
+    p2 = p.px * p.px + p.py * p.py + p.pz * p.pz
+    result = []
+    for j in js:
+        q = jets[j]
+        cos_theta = (p.px * q.px + p.py * q.py + p.pz * q.pz) / \
+            m.sqrt(p2 * (q.px * q.px + q.py * q.py + q.pz * q.pz))
+        one_minus_cos = 1. - min(max(cos_theta, -1.), 1.)
+        result.append(
+            (2. * min(p.E**2, q.E**2) * one_minus_cos / q2, one_minus_cos)
+        )
+    return result
+
+def y_ij(p_i, p_j, q2):
+    """Returns the Durham distance measure y_ij between the momenta `p_i` and
+    `p_j` for the reference scale Q^2 = `q2`, see `cluster`."""
+    return _distances([p_i, p_j], 0, [1], q2)[0][0]
+
+def _cluster_durham(jets, active, owner, q2, y_cut, n_jets, scheme):
+    # nearest neighbour (distance, index) of each active jet among the active
+    # jets with a larger index
+    nearest = {}
+
+    def update(i):
+        later = [j for j in active if j > i]
+        if later:
+            nearest[i] = min(
+                zip((y for y, _ in _distances(jets, i, later, q2)), later)
+            )
+        else:
+            nearest.pop(i, None)
+
+    for i in active:
+        update(i)
+    scales = []
+    while len(active) > n_jets:
+        i = min(nearest, key=nearest.get)
+        y, j = nearest[i]
+        if y_cut is not None and y > y_cut:
+            break
+        scales.append(y)
+        jets[i] = recombine(jets[i], jets[j], scheme)
+        owner[j] = i
+        active.remove(j)
+        del nearest[i]
+        nearest.pop(j, None)
+        # only jets whose nearest neighbour was i or j, and i itself, need a
+        # full update, the others only need to compare to the new jet i
+        for k in active:
+            if k == i:
+                update(k)
+            elif k < i:
+                if nearest[k][1] in (i, j):
+                    update(k)
+                else:
+                    y_ki = _distances(jets, k, [i], q2)[0][0]
+                    if (y_ki, i) < nearest[k]:
+                        nearest[k] = (y_ki, i)
+            elif k < j and nearest[k][1] == j:
+                update(k)
+    return scales
+
+def _cluster_cambridge(jets, active, owner, q2, y_cut, n_jets, scheme):
+    scales = []
+    frozen = []
+    while len(active) > n_jets:
+        best = None
+        for a, i in enumerate(active[:-1]):
+            for (y, v), j in zip(
+                _distances(jets, i, active[a + 1:], q2), active[a + 1:]
+            ):
+                if best is None or v < best[0]:
+                    best = (v, y, i, j)
+        _, y, i, j = best
+        if y < y_cut:
+            scales.append(y)
+            jets[i] = recombine(jets[i], jets[j], scheme)
+            owner[j] = i
+            active.remove(j)
+        else:
+            softer = i if jets[i].E < jets[j].E else j
+            active.remove(softer)
+            frozen.append(softer)
+    return scales, frozen
@@ -0,0 +1,267 @@
+"""This file keeps the differential jet rate histograms of running analyses in
+shared memory, so that a separate monitor process can follow a long run
+without stopping it.
+
+The block holds one slot per worker. Each worker only writes to its own slot,
+so that no locking is needed, and the monitor merges the slots when reading.
+Since the monitor reads while the workers write, a snapshot may mix the
+content before and after the latest event of a worker, which is irrelevant
+for monitoring. Example usage, with the block created by the steering process:
+
+  block = LiveBlock.create(workers=4)
+  # in worker i, given block.name
+  slot = LiveBlock.attach(name).slot(i)
+  analysis = Analysis()
+  analysis.share(slot)
+  # in another shell
+  python -m utils.live <name> --interval 10 --export live.yoda
+
+"""
+
+import argparse
+import os
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from utils.histogram import ArrayHisto1D
+from utils.storage import atomic_file
+
+# the first entry of the header, checked when attaching, so that a monitor
+# of another checkout does not misread the slots of a running block
+VERSION = 1
+# version, workers, histograms, bins, xmin, xmax
+HEADER = 6
+# per slot: events, sum of weights, start time, time of the latest update
+COUNTERS = ("events", "sumw", "start", "update")
+# the moments of each histogram bin, as in `ArrayHisto1D`
+MOMENTS = ArrayHisto1D.moments
+
+class LiveSlot:
+    """The part of a `LiveBlock` written by a single worker. `counters` holds
+    the `COUNTERS` and `moments` the `MOMENTS` of each histogram, with shape
+    (histograms, moments, bins + 2), including the under- and overflow."""
+
+    def __init__(self, block, counters, moments):
+        # the views are only valid as long as the block is mapped
+        self.block = block
+        self.counters = counters
+        self.moments = moments
+
+    def start(self):
+        """Clears the slot and sets its start time to now."""
+        self.counters[:] = 0.
+        self.moments[:] = 0.
+        self.counters[2] = self.counters[3] = time.time()
+
+    def count(self, weight):
+        """Records an analysed event of weight `weight`."""
+        counters = self.counters
+        counters[0] += 1.
+        counters[1] += weight
+        counters[3] = time.time()
+
+class LiveBlock:
+    """A shared memory block of histogram moments with one `LiveSlot` per
+    worker, see the module description. Use `create` or `attach` to get an
+    instance."""
+
+    def __init__(self, memory):
+        self.memory = memory
+        header = np.ndarray((HEADER,), dtype=np.float64, buffer=memory.buf)
+        if int(header[0]) != VERSION:
+            raise ValueError(
+                "{0} is not a live histogram block of version {1}.".format(
+                    memory.name, VERSION
+                )
+            )
+        self.workers, self.histograms, self.bins = (int(v) for v in header[1:4])
+        self.xmin, self.xmax = float(header[4]), float(header[5])
+        self.data = np.ndarray(
+            (self.workers, self.slot_size()),
+            dtype=np.float64,
+            buffer=memory.buf,
+            offset=HEADER * 8
+        )
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @staticmethod
+    def size(workers, histograms, bins):
+        """Returns the size of a block in bytes."""
+        return 8 * (
+            HEADER + workers *
+            (len(COUNTERS) + histograms * len(MOMENTS) * (bins + 2))
+        )
+
+    def slot_size(self):
+        return len(COUNTERS) + self.histograms * len(MOMENTS) * (self.bins + 2)
+
+    @classmethod
+    def create(
+        cls, workers, histograms=4, bins=100, xmin=-4.3, xmax=-0.3, name=None
+    ):
+        """Creates a block for `workers` workers, each filling `histograms`
+        histograms of `bins` bins between `xmin` and `xmax`, which defaults to
+        the binning of `Analysis`. The creating process owns the block and has
+        to `unlink` it when the run is over."""
+        memory = shared_memory.SharedMemory(
+            name=name, create=True, size=cls.size(workers, histograms, bins)
+        )
+        header = np.ndarray((HEADER,), dtype=np.float64, buffer=memory.buf)
+        header[:] = (VERSION, workers, histograms, bins, xmin, xmax)
+        block = cls(memory)
+        block.data[:] = 0.
+        return block
+
+    @classmethod
+    def attach(cls, name, track=True):
+        """Attaches to the existing block `name`, e.g. from a worker or a
+        monitor. Processes that were not started by the creator of the block,
+        like a monitor, have to pass `track=False`, since otherwise their
+        resource tracker removes the block when they exit."""
+        if track or sys.version_info < (3, 13):
+            memory = shared_memory.SharedMemory(name=name)
+            if not track and os.name == "posix":
+                # the tracker knows the block by its POSIX name, which has the
+                # leading slash stripped from `memory.name`
+                resource_tracker.unregister("/" + memory.name, "shared_memory")
+        else:
+            memory = shared_memory.SharedMemory(name=name, track=False)
+        return cls(memory)
+
+    def slot(self, worker):
+        """Returns the `LiveSlot` of worker number `worker`."""
+        data = self.data[worker]
+        return LiveSlot(
+            self,
+            data[:len(COUNTERS)],
+            data[len(COUNTERS):].reshape(
+                self.histograms, len(MOMENTS), self.bins + 2
+            )
+        )
+
+    def snapshot(self):
+        """Returns a copy of the counters of all slots, with shape (workers,
+        counters), and the moments merged over all slots, with shape
+        (histograms, moments, bins + 2)."""
+        data = self.data.copy()
+        counters = data[:, :len(COUNTERS)]
+        moments = data[:, len(COUNTERS):].reshape(
+            self.workers, self.histograms, len(MOMENTS), self.bins + 2
+        ).sum(axis=0)
+        return counters, moments
+
+    def histograms_from(self, moments, events):
+        """Returns the `ArrayHisto1D`s of the merged `moments`, normalised to
+        the number of `events` like in `Analysis.finalize`."""
+        result = []
+        for i, data in enumerate(moments):
+            histo = ArrayHisto1D(
+                self.bins,
+                self.xmin,
+                self.xmax,
+                '/LL_JetRates/log10_y_{0}{1}'.format(i + 2, i + 3)
+            )
+            histo.data[:] = data
+            if events:
+                # sumwx2 is filled with w*w*x in Histo1D, so it scales like
+                # sumw2 there
+                factor = 1. / events
+                histo.data[[0, 2]] *= factor
+                histo.data[[1, 3]] *= factor * factor
+                histo.scaled_by = factor
+            result.append(histo)
+        return result
+
+    def close(self):
+        self.data = None
+        self.memory.close()
+
+    def unlink(self):
+        """Removes the block, after which it can no longer be attached."""
+        self.memory.unlink()
+
+def summary(block, counters, moments, now=None):
+    """Returns a printable summary of a snapshot of `block`, as returned by
+    `LiveBlock.snapshot`: the events and events/s of each worker and in total
+    and the cross section and mean log10(y) of each histogram. The cross
+    section is the sum of weights per event, so it is in the unit of the
+    event weights, e.g. pb, or a fraction of the events for unit weights."""
+    now = time.time() if now is None else now
+    lines = []
+    events = counters[:, 0].sum()
+    rate = 0.
+    for worker, (n, _, start, update) in enumerate(counters):
+        if n == 0:
+            lines.append("worker {0:<3} idle".format(worker))
+            continue
+        worker_rate = n / (update - start) if update > start else 0.
+        rate += worker_rate
+        lines.append(
+            "worker {0:<3} {1:>10.0f} events {2:10.1f} events/s, "
+            "last update {3:.0f}s ago".format(
+                worker, n, worker_rate, now - update
+            )
+        )
+    lines.append("total      {0:>10.0f} events {1:10.1f} events/s".format(
+        events, rate
+    ))
+    for i, data in enumerate(moments):
+        sumw = data[0, 1:-1].sum()
+        sumwx = data[2, 1:-1].sum()
+        lines.append(
+            "log10_y_{0}{1}: sigma in range {2:.5g}, mean {3:.3f}".format(
+                i + 2,
+                i + 3,
+                sumw / events if events else 0.,
+                sumwx / sumw if sumw else float("nan")
+            )
+        )
+    return "\n".join(lines)
+
+def export(block, counters, moments, file_name):
+    """Writes the merged histograms of a snapshot of `block` to the YODA file
+    `file_name`. The file is replaced atomically, so that plotting it never
+    sees a partially written file."""
+    histos = block.histograms_from(moments, counters[:, 0].sum())
+    with atomic_file(file_name) as temporary:
+        with open(temporary, "w") as file:
+            file.write("\n\n".join(str(h) for h in histos))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Monitor the live histograms of a running analysis."
+    )
+    parser.add_argument("name", help="name of the shared memory block")
+    parser.add_argument(
+        "--interval",
+        type=float,
+        help="seconds between updates, print once if not given"
+    )
+    parser.add_argument("--export", help="YODA file to write the histograms to")
+    args = parser.parse_args(argv)
+
+    block = LiveBlock.attach(args.name, track=False)
+    try:
+        while True:
+            counters, moments = block.snapshot()
+            print(summary(block, counters, moments), flush=True)
+            if args.export is not None:
+                export(block, counters, moments, args.export)
+            if args.interval is None:
+                break
+            time.sleep(args.interval)
+            print()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        block.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""This file implements the scalar sampling helpers of the overestimates used
+by the veto algorithm of the shower. The functions are plain Python, so that
+`utils.shower` calls them directly and `utils.shower_jit` compiles the very
+same code with numba, and the two backends cannot drift apart."""
+
+import random
+from numpy import ceil, log, log10
+
+def generate_soft_z(zm, zp, c):
+    """Generates z in [zm, zp] according to the density 1 / (1 - z) - c, where
+    0 <= c < 1, by solving for u = 1 - z with Newton's method. The iteration
+    starts from the solution for c = 0 and converges since the integral is a
+    convex, monotonic function of u."""
+    a = 1. - zm
+    b = 1. - zp
+    r = random.random()
+    target = r * (log(a / b) - c * (a - b))
+    u = a * pow(b / a, r)
+    for _ in range(50):
+        du = (log(a / u) - c * (a - u) - target) / (c - 1. / u)
+        u -= du
+        if abs(du) < 1.e-12 * u: break
+    return 1. - u
+
+def alphas_bin_edge(k, t0, bins):
+    """Returns the lower edge of the k-th logarithmic t bin of the piecewise
+    constant coupling overestimate, with `bins` bins per decade above `t0`."""
+    return t0 * pow(10., k / bins)
+
+def alphas_bin(t, t0, bins):
+    """Returns the index of the t bin containing the scale `t`, see
+    `alphas_bin_edge`, or 0 if `bins` is 0, i.e. for a single global
+    overestimate."""
+    if bins == 0 or t <= t0:
+        return 0
+    k = max(int(ceil(log10(t / t0) * bins)) - 1, 0)
+    # correct for rounding at the lower bin edge, see `alphas_bin_edge`
+    if t < t0 * pow(10., k / bins):
+        k -= 1
+    return k
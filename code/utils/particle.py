@@ -5,10 +5,15 @@ from utils.vector import Vec4
 class Particle:
     """A simple particle class."""
 
-    def __init__(self, ptcl_num, momentum, color=[0, 0]):
+    def __init__(self, ptcl_num, momentum, color=None):
         """Initializes a particle given its particle number, a momentum, and a
         2-component list giving its color and its anti-color, where 0 stand for
-        "no color"."""
+        "no color", which is the default.
+
+        The color list is copied, but the momentum is kept by reference: the
+        shower updates the momenta of the splitter and the spectator in place,
+        so a caller who needs the momentum from before the shower has to
+        copy it."""
         self.set(ptcl_num, momentum, color)
 
     def __repr__(self):
@@ -17,10 +22,10 @@ class Particle:
     def __str__(self):
         return "{0} {1} {2}".format(self.pid, self.mom, self.color)
 
-    def set(self, ptcl_num, momentum, color=[0, 0]):
+    def set(self, ptcl_num, momentum, color=None):
         self.pid = ptcl_num
         self.mom = momentum
-        self.color = color
+        self.color = [0, 0] if color is None else list(color)
 
     def is_color_connected(self, other):
         """Checks if this and some other particle are "color-connected",
@@ -0,0 +1,161 @@
+"""This file provides opt-in counters and timers for the hot paths of the
+shower simulation."""
+
+import gc
+import json
+import time
+import tracemalloc
+
+class KernelCounter:
+    """Trial and veto bookkeeping for a single type of splitting kernel."""
+
+    def __init__(self):
+        self.trials = 0
+        self.rejected_y = 0
+        self.vetoed = 0
+        self.accepted = 0
+        self.sum_ratio = 0.
+        self.max_ratio = 0.
+
+    def add_ratio(self, ratio):
+        """Record the veto ratio f/g of a trial that passed the y < 1 check."""
+        self.sum_ratio += ratio
+        if ratio > self.max_ratio:
+            self.max_ratio = ratio
+
+    def as_dict(self):
+        vetoable = self.vetoed + self.accepted
+        return {
+            "trials": self.trials,
+            "rejected_y": self.rejected_y,
+            "vetoed": self.vetoed,
+            "accepted": self.accepted,
+            "efficiency": self.accepted / self.trials if self.trials else 0.,
+            "mean_ratio": self.sum_ratio / vetoable if vetoable else 0.,
+            "max_ratio": self.max_ratio,
+        }
+
+class ShowerStats:
+    """Collects counters and timings of a `Shower` run.
+
+    Pass an instance as `stats` to the `Shower` constructor. Without it the
+    shower does not record anything. Example usage:
+
+      stats = ShowerStats()
+      shower = Shower(alphas, stats=stats)
+      ...
+      stats.to_json("shower_stats.json")
+
+    The number of garbage collector runs during the events is always
+    recorded. With `track_memory=True`, the memory allocated per event is
+    traced with `tracemalloc` as well, which is started if it is not running
+    yet and slows the shower down considerably.
+    """
+
+    phases = ("search", "veto", "kinematics", "colors")
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.reset()
+
+    def reset(self):
+        """Forget all recorded counters and timings."""
+        self.kernels = {}
+        self.mass_skips = 0
+        self.num_events = 0
+        self.emissions = {}
+        self.phase_times = {phase: 0. for phase in self.phases}
+        self.event_time = 0.
+        self.event_time_min = float("inf")
+        self.event_time_max = 0.
+        self._event_start = 0.
+        self.gc_collections = [0] * len(gc.get_stats())
+        self._gc_start = list(self.gc_collections)
+        # transient = peak above the memory at the start of an event, retained
+        # = memory left allocated at its end
+        self.memory_transient = 0
+        self.memory_transient_max = 0
+        self.memory_retained = 0
+        self._memory_start = 0
+
+    def kernel(self, name):
+        """Returns the counter of the kernel type `name`, creating it if
+        necessary."""
+        try:
+            return self.kernels[name]
+        except KeyError:
+            counter = self.kernels[name] = KernelCounter()
+            return counter
+
+    def start_event(self):
+        self._gc_start = [g["collections"] for g in gc.get_stats()]
+        if self.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self._memory_start = tracemalloc.get_traced_memory()[0]
+        self._event_start = time.perf_counter()
+
+    def end_event(self, num_emissions):
+        elapsed = time.perf_counter() - self._event_start
+        for i, g in enumerate(gc.get_stats()):
+            self.gc_collections[i] += g["collections"] - self._gc_start[i]
+        if self.track_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            transient = peak - self._memory_start
+            self.memory_transient += transient
+            self.memory_transient_max = max(self.memory_transient_max, transient)
+            self.memory_retained += current - self._memory_start
+        self.num_events += 1
+        self.emissions[num_emissions] = self.emissions.get(num_emissions, 0) + 1
+        self.event_time += elapsed
+        self.event_time_min = min(self.event_time_min, elapsed)
+        self.event_time_max = max(self.event_time_max, elapsed)
+
+    def add_time(self, phase, elapsed):
+        self.phase_times[phase] += elapsed
+
+    def as_dict(self):
+        """Returns a summary of all recorded data as a JSON-serializable
+        dictionary."""
+        trials = sum(k.trials for k in self.kernels.values())
+        accepted = sum(k.accepted for k in self.kernels.values())
+        mean_time = self.event_time / self.num_events if self.num_events else 0.
+        per_event = lambda x: x / self.num_events if self.num_events else 0.
+        summary = {
+            "events": self.num_events,
+            "trials": trials,
+            "accepted": accepted,
+            "trials_per_emission": trials / accepted if accepted else 0.,
+            "mass_skips": self.mass_skips,
+            "kernels": {
+                name: counter.as_dict()
+                for name, counter in sorted(self.kernels.items())
+            },
+            "emissions_per_event": {
+                str(n): count for n, count in sorted(self.emissions.items())
+            },
+            "phase_times": dict(self.phase_times),
+            "event_time": {
+                "total": self.event_time,
+                "mean": mean_time,
+                "min": self.event_time_min if self.num_events else 0.,
+                "max": self.event_time_max,
+            },
+            "gc_collections": {
+                "generations": list(self.gc_collections),
+                "per_event": per_event(sum(self.gc_collections)),
+            },
+        }
+        if self.track_memory:
+            summary["memory"] = {
+                "transient_mean": per_event(self.memory_transient),
+                "transient_max": self.memory_transient_max,
+                "retained_mean": per_event(self.memory_retained),
+            }
+        return summary
+
+    def to_json(self, file_name):
+        """Writes the summary returned by `as_dict` to the file `file_name`."""
+        with open(file_name, "w") as file:
+            json.dump(self.as_dict(), file, indent=2)
@@ -1,8 +1,13 @@
+import math as m
 import random
-from numpy import pi, sqrt, tan, arctan, log, cos, sin
+import time
+import warnings
+from numpy import pi, sqrt, tan, arctan, log
 
 from utils.vector import Vec4
+from utils.overestimates import alphas_bin, alphas_bin_edge, generate_soft_z
 from utils.particle import Particle, check_event
+from utils.sudakov import IntegralTable
 
 # QCD group constants
 NC = 3.
@@ -27,13 +32,14 @@ class Pqq(Kernel):
         return CF * (2. / (1. - z * (1. - y)) - (1. + z))
 
     def Estimate(self, z):
-        return CF * 2. / (1. - z)
+        # -(1 + z) <= -1 for all z in [0, 1]
+        return CF * (2. / (1. - z) - 1.)
 
     def Integral(self, zm, zp):
-        return CF * 2. * log((1. - zm) / (1. - zp))
+        return CF * (2. * log((1. - zm) / (1. - zp)) - (zp - zm))
 
     def GenerateZ(self, zm, zp):
-        return 1. + (zp - 1.) * pow((1. - zm) / (1. - zp), random.random())
+        return generate_soft_z(zm, zp, .5)
 
 class Pgg(Kernel):
     """
@@ -44,13 +50,14 @@ class Pgg(Kernel):
         return CA / 2. * (2. / (1. - z * (1. - y)) - 2. + z * (1. - z))
 
     def Estimate(self, z):
-        return CA / (1. - z)
+        # -2 + z * (1 - z) <= -7 / 4 for all z in [0, 1]
+        return CA * (1. / (1. - z) - 7. / 8.)
 
     def Integral(self, zm, zp):
-        return CA * log((1. - zm) / (1. - zp))
+        return CA * (log((1. - zm) / (1. - zp)) - 7. / 8. * (zp - zm))
 
     def GenerateZ(self, zm, zp):
-        return 1. + (zp - 1.) * pow((1. - zm) / (1. - zp), random.random())
+        return generate_soft_z(zm, zp, 7. / 8.)
 
 class Pgq(Kernel):
     """
@@ -74,12 +81,56 @@ class Shower:
     A simple shower cascade simulator.
     """
 
-    def __init__(self, alphas, t0=1.0):
+    def __init__(
+        self,
+        alphas,
+        t0=1.0,
+        stats=None,
+        alphas_bins=8,
+        variations=None,
+        jit=False,
+        integral_cache=None
+    ):
         """Initializes the shower and its splitting kernels, given a AlphaS
-        strong coupling instance `alphas` and a lower cut-off scale `t0`."""
+        strong coupling instance `alphas` and a lower cut-off scale `t0`.
+
+        Optionally, a `utils.profiling.ShowerStats` instance can be passed as
+        `stats` to record trial counters and timings of the veto algorithm.
+
+        The trial emissions use a piecewise constant overestimate of the
+        coupling on `alphas_bins` logarithmic bins per decade in t above
+        `t0`, which assumes that `alphas` is decreasing. Passing
+        `alphas_bins=0` uses the single global overestimate `alphas(t0)`.
+
+        `variations` maps names to alternative strong couplings, e.g. an
+        `AlphaS` instance of different order or `asmz`, or a `ScaledAlphaS`
+        for a renormalisation scale variation. For each of them, `run` keeps a
+        reweighting factor in `self.weights` that turns the generated event
+        into one showered with that coupling instead. The reweighting of
+        vetoed trials is only valid if the overestimate also bounds the
+        variations, so it is taken as the largest of all couplings, see
+        `alphas_bound`, which lowers the acceptance of the nominal shower for
+        upward variations.
+
+        With `jit=True`, the emissions are generated by compiled code on
+        array-backed events, see `utils.shower_jit`. If numba is not
+        installed, `alphas` is no `AlphaS` instance or `stats` or `variations`
+        are requested, the shower warns and uses the Python implementation.
+
+        The trial emissions take the kernel integrals from the tables of
+        `utils.sudakov.IntegralTable`, which bound them from above. If an
+        `integral_cache` directory is given, the tables are stored there and
+        reused by later showers with the same cut-off and kernels.
+        """
         self.t0 = t0
+        self.stats = stats
         self.alphas = alphas
-        self.alphas_max = alphas(self.t0)
+        self.variations = variations or {}
+        self.alphas_max = self.alphas_bound(self.t0)
+        self.alphas_bins = alphas_bins
+        # lower edges and coupling overestimates of the t bins, grown on demand
+        self.alphas_bounds = [(self.t0, self.alphas_max)]
+        self.weights = {name: 1. for name in self.variations}
         # set up q->qg splitting kernels
         self.kernels = [
             Pqq([fl, fl, 21]) for fl in [-5, -4, -3, -2, -1, 1, 2, 3, 4, 5]
@@ -88,102 +139,265 @@ class Shower:
         self.kernels += [Pgq([21, fl, -fl]) for fl in [1, 2, 3, 4, 5]]
         # set up g->gg splitting kernels
         self.kernels += [Pgg([21, 21, 21])]
+        if integral_cache is None:
+            self.integrals = IntegralTable(self.kernels, self.t0)
+        else:
+            self.integrals = IntegralTable.cached(
+                self.kernels, self.t0, integral_cache
+            )
+        # tabulated bounds of Integral / (2 pi), shared by kernels of a type
+        bounds = {
+            kernel_type: [v / (2. * pi) for v in values]
+            for kernel_type, values in self.integrals.values.items()
+        }
+        self.kernel_bounds = [bounds[type(sf)] for sf in self.kernels]
+        self.compiled = None
+        if jit:
+            import utils.shower_jit
+            reason = utils.shower_jit.unsupported(self)
+            if reason is None:
+                self.compiled = utils.shower_jit.CompiledShower(self)
+            else:
+                warnings.warn(
+                    "Using the Python shower instead of the compiled one, "
+                    "since {0}.".format(reason),
+                    RuntimeWarning,
+                    stacklevel=2
+                )
+
+    def alphas_bound(self, t):
+        """Returns the largest value of the nominal coupling and of the
+        coupling variations at the scale `t`."""
+        bound = self.alphas(t)
+        for alphas_var in self.variations.values():
+            bound = max(bound, alphas_var(t))
+        return bound
+
+    def alphas_bin(self, t):
+        """Returns the index of the t bin containing the scale `t`, booking
+        the coupling overestimates of all bins up to it."""
+        k = alphas_bin(t, self.t0, self.alphas_bins)
+        while len(self.alphas_bounds) <= k:
+            tlow = alphas_bin_edge(
+                len(self.alphas_bounds), self.t0, self.alphas_bins
+            )
+            self.alphas_bounds.append((tlow, self.alphas_bound(tlow)))
+        return k
 
     def make_kinematics(self, z, y, phi, pijt, pkt):
         """Calculate the two momenta of the daughters after a splitting, and
         the one momentum of the `spectator`, taking the recoil of the
         splitting.
 
-        Returns the momenta in a list in that order.
+        Returns the momenta in a list in that order, leaving `pijt` and `pkt`
+        unchanged, see `make_kinematics_inplace`.
         """
-        Q = pijt + pkt
-        rkt = sqrt(Q.invariant_mass_squared() * y * z * (1. - z))
-        kt1 = pijt.cross_product(pkt)
-        if kt1.length_3d() < 1.e-6:
-            kt1 = pijt.cross_product(Vec4(0., 1., 0., 0.))
-        kt1 *= rkt * cos(phi) / kt1.length_3d()
-        kt2cms = Q.boost(pijt).cross_product(kt1)
-        kt2cms *= rkt * sin(phi) / kt2cms.length_3d()
-        kt2 = Q.boost_back(kt2cms)
-        pi = z * pijt + (1. - z) * y * pkt + kt1 + kt2
-        pj = (1. - z) * pijt + z * y * pkt - kt1 - kt2
-        pk = (1. - y) * pkt
+        pi = Vec4(pijt.E, pijt.px, pijt.py, pijt.pz)
+        pk = Vec4(pkt.E, pkt.px, pkt.py, pkt.pz)
+        pj = Vec4()
+        self.make_kinematics_inplace(z, y, phi, pi, pk, pj)
         return [pi, pj, pk]
 
+    def make_kinematics_inplace(self, z, y, phi, pij, pk, pj):
+        """Calculates the momenta of `make_kinematics` on the components
+        directly instead of temporary vectors: the splitter momentum `pij` is
+        overwritten by the momentum of the first daughter, the spectator
+        momentum `pk` by its recoiled momentum and the momentum of the second
+        daughter is stored in `pj`."""
+        qE, qx, qy, qz = pij.E + pk.E, pij.px + pk.px, pij.py + pk.py, \
+            pij.pz + pk.pz
+        q2 = qE * qE - qx * qx - qy * qy - qz * qz
+        rkt = m.sqrt(q2 * y * z * (1. - z))
+        # kt1 = pij x pk, or pij x (0, 1, 0, 0) for collinear momenta
+        k1x = pij.py * pk.pz - pij.pz * pk.py
+        k1y = pij.pz * pk.px - pij.px * pk.pz
+        k1z = pij.px * pk.py - pij.py * pk.px
+        length = m.sqrt(k1x * k1x + k1y * k1y + k1z * k1z)
+        if length < 1.e-6:
+            k1x, k1y, k1z = 0., pij.pz, -pij.py
+            length = m.sqrt(k1x * k1x + k1y * k1y + k1z * k1z)
+        f = rkt * m.cos(phi) / length
+        k1x, k1y, k1z = k1x * f, k1y * f, k1z * f
+        # boost pij into the rest frame of q and take the cross product
+        rsq = m.sqrt(q2)
+        v0 = (qE * pij.E - qx * pij.px - qy * pij.py - qz * pij.pz) / rsq
+        c1 = (pij.E + v0) / (rsq + qE)
+        bx, by, bz = pij.px - c1 * qx, pij.py - c1 * qy, pij.pz - c1 * qz
+        k2x = by * k1z - bz * k1y
+        k2y = bz * k1x - bx * k1z
+        k2z = bx * k1y - by * k1x
+        f = rkt * m.sin(phi) / m.sqrt(k2x * k2x + k2y * k2y + k2z * k2z)
+        k2x, k2y, k2z = k2x * f, k2y * f, k2z * f
+        # boost kt2 back to the lab frame
+        k2E = (qx * k2x + qy * k2y + qz * k2z) / rsq
+        c1 = k2E / (rsq + qE)
+        k2x, k2y, k2z = k2x + c1 * qx, k2y + c1 * qy, k2z + c1 * qz
+        a, b = (1. - z) * y, z * y
+        pj.E = (1. - z) * pij.E + b * pk.E - k2E
+        pj.px = (1. - z) * pij.px + b * pk.px - k1x - k2x
+        pj.py = (1. - z) * pij.py + b * pk.py - k1y - k2y
+        pj.pz = (1. - z) * pij.pz + b * pk.pz - k1z - k2z
+        pij.E = z * pij.E + a * pk.E + k2E
+        pij.px = z * pij.px + a * pk.px + k1x + k2x
+        pij.py = z * pij.py + a * pk.py + k1y + k2y
+        pij.pz = z * pij.pz + a * pk.pz + k1z + k2z
+        a = 1. - y
+        pk.E, pk.px, pk.py, pk.pz = a * pk.E, a * pk.px, a * pk.py, a * pk.pz
+
     def make_colors(self, ptcl_nums, colij, colk):
         """Assign new colors after a splitting, using the leading color
         approximation.
 
         Returns a list of two color pairs, one for each of the daughters of the
-        splitting.
+        splitting, leaving `colij` unchanged, see `make_colors_inplace`.
         """
+        coli = list(colij)
+        colj = [0, 0]
+        self.make_colors_inplace(ptcl_nums, coli, colk, colj)
+        return [coli, colj]
+
+    def make_colors_inplace(self, ptcl_nums, colij, colk, colj):
+        """Assigns the colors of `make_colors`, but overwrites the color pair
+        `colij` of the splitter by that of the first daughter and stores the
+        color pair of the second daughter in `colj`."""
         self.current_color_index += 1
+        index = self.current_color_index
         if ptcl_nums[0] != 21:
             if ptcl_nums[0] > 0:
-                return [[self.current_color_index, 0],
-                        [colij[0], self.current_color_index]]
+                colj[0], colj[1] = colij[0], index
+                colij[0], colij[1] = index, 0
             else:
-                return [[0, self.current_color_index],
-                        [self.current_color_index, colij[1]]]
-        else:
-            if ptcl_nums[1] == 21:
-                if colij[0] == colk[1]:
-                    if colij[1] == colk[0] and random.random() > 0.5:
-                        return [[colij[0], self.current_color_index],
-                                [self.current_color_index, colij[1]]]
-                    return [[self.current_color_index, colij[1]],
-                            [colij[0], self.current_color_index]]
-                else:
-                    return [[colij[0], self.current_color_index],
-                            [self.current_color_index, colij[1]]]
+                colj[0], colj[1] = index, colij[1]
+                colij[0], colij[1] = 0, index
+        elif ptcl_nums[1] == 21:
+            if colij[0] == colk[1] and \
+               not (colij[1] == colk[0] and random.random() > 0.5):
+                colj[0], colj[1] = colij[0], index
+                colij[0] = index
             else:
-                if ptcl_nums[1] > 0:
-                    return [[colij[0], 0], [0, colij[1]]]
-                else:
-                    return [[0, colij[1]], [colij[0], 0]]
+                colj[0], colj[1] = index, colij[1]
+                colij[1] = index
+        elif ptcl_nums[1] > 0:
+            colj[0], colj[1] = 0, colij[1]
+            colij[1] = 0
+        else:
+            colj[0], colj[1] = colij[0], 0
+            colij[0] = 0
 
     def generate_next_emission(self, event):
         """Generate the next emission starting from the current scale `self.t`,
         using the Sudakov veto algorithm. The passed event (= list of Particle instances)
         is modified in-place, if a splitting occurs."""
+        stats = self.stats
         while self.t > self.t0:
+            if stats is not None: start = time.perf_counter()
             t = self.t0
+            k = self.alphas_bin(self.t)
             for split in event[2:]:
                 for spect in event[2:]:
                     if spect == split: continue
                     if not split.is_color_connected(spect): continue
-                    for sf in self.kernels:
+                    p, q = split.mom, spect.mom
+                    E, px, py, pz = p.E + q.E, p.px + q.px, p.py + q.py, \
+                        p.pz + q.pz
+                    m2 = E * E - px * px - py * py - pz * pz
+                    if m2 >= 4. * self.t0: cell = self.integrals.cell(m2)
+                    for sf, bounds in zip(self.kernels, self.kernel_bounds):
                         if sf.ptcl_nums[0] != split.pid: continue
-                        m2 = (split.mom + spect.mom).invariant_mass_squared()
-                        if m2 < 4. * self.t0: continue
-                        zp = .5 * (1. + sqrt(1. - 4. * self.t0 / m2))
-                        g = self.alphas_max / (2. *
-                                               pi) * sf.Integral(1. - zp, zp)
-                        tt = self.t * pow(random.random(), 1. / g)
+                        if m2 < 4. * self.t0:
+                            if stats is not None: stats.mass_skips += 1
+                            continue
+                        if cell < len(bounds):
+                            integral = bounds[cell]
+                        else:
+                            integral = self.integrals.lookup(sf, m2) / (2. * pi)
+                        # The overestimate is constant within each t bin, so
+                        # the trial scale is generated bin by bin downwards
+                        # until it either lies within the current bin or can
+                        # no longer beat the highest trial scale `t` so far.
+                        tt = self.t
+                        kk = k
+                        while True:
+                            tlow, as_max = self.alphas_bounds[kk]
+                            g = as_max * integral
+                            tt *= pow(random.random(), 1. / g)
+                            if tt > tlow or tlow <= t: break
+                            tt = tlow
+                            kk -= 1
                         if tt > t:
                             t = tt
-                            s = [split, spect, sf, m2, zp]
+                            sel_split, sel_spect, sel_sf = split, spect, sf
+                            sel_m2, sel_integral, sel_bin = m2, integral, kk
             self.t = t
+            if stats is not None:
+                stop = time.perf_counter()
+                stats.add_time("search", stop - start)
+                start = stop
             if t > self.t0:
-                z = s[2].GenerateZ(1. - s[4], s[4])
-                y = t / s[3] / z / (1. - z)
+                if stats is not None:
+                    counter = stats.kernel(type(sel_sf).__name__)
+                    counter.trials += 1
+                zp = .5 * (1. + sqrt(1. - 4. * self.t0 / sel_m2))
+                z = sel_sf.GenerateZ(1. - zp, zp)
+                y = t / sel_m2 / z / (1. - z)
                 if y < 1.:
-                    f = (1. - y) * self.alphas(t) * s[2].Value(z, y)
-                    g = self.alphas_max * s[2].Estimate(z)
-                    if f / g > random.random():
+                    alphas = self.alphas(t)
+                    f = (1. - y) * alphas * sel_sf.Value(z, y)
+                    g = self.alphas_bounds[sel_bin][1] * sel_sf.Estimate(z)
+                    # the trial scale was generated with the tabulated bound
+                    # of the integral, which the veto has to compensate
+                    ratio = f / g * sel_sf.Integral(1. - zp, zp) / \
+                        (2. * pi * sel_integral)
+                    if stats is not None: counter.add_ratio(ratio)
+                    accept = ratio > random.random()
+                    if self.variations:
+                        self.reweight(t, alphas, ratio, accept)
+                    if accept:
                         phi = 2. * pi * random.random()
-                        moms = self.make_kinematics(
-                            z, y, phi, s[0].mom, s[1].mom
+                        if stats is not None:
+                            counter.accepted += 1
+                            stop = time.perf_counter()
+                            stats.add_time("veto", stop - start)
+                            start = stop
+                        # the emitted particle is the only new object, the
+                        # splitter and spectator are updated in place
+                        emitted = Particle(sel_sf.ptcl_nums[2], Vec4(), [0, 0])
+                        self.make_kinematics_inplace(
+                            z, y, phi, sel_split.mom, sel_spect.mom, emitted.mom
                         )
-                        cols = self.make_colors(
-                            s[2].ptcl_nums, s[0].color, s[1].color
+                        if stats is not None:
+                            stop = time.perf_counter()
+                            stats.add_time("kinematics", stop - start)
+                            start = stop
+                        self.make_colors_inplace(
+                            sel_sf.ptcl_nums,
+                            sel_split.color,
+                            sel_spect.color,
+                            emitted.color
                         )
-                        event.append(
-                            Particle(s[2].ptcl_nums[2], moms[1], cols[1])
-                        )
-                        s[0].set(s[2].ptcl_nums[1], moms[0], cols[0])
-                        s[1].mom = moms[2]
+                        sel_split.pid = sel_sf.ptcl_nums[1]
+                        event.append(emitted)
+                        if stats is not None:
+                            stats.add_time("colors", time.perf_counter() - start)
                         return
+                    if stats is not None: counter.vetoed += 1
+                elif stats is not None:
+                    counter.rejected_y += 1
+                if stats is not None:
+                    stats.add_time("veto", time.perf_counter() - start)
+
+    def reweight(self, t, alphas, ratio, accepted):
+        """Updates the weights of the coupling variations after a trial
+        emission at scale `t`, which the nominal coupling value `alphas`
+        accepted with probability `ratio`, depending on whether it was
+        `accepted`. Since the overestimate bounds all variations, their
+        acceptance probabilities do not exceed one."""
+        for name, alphas_var in self.variations.items():
+            ratio_var = ratio * alphas_var(t) / alphas
+            if accepted:
+                self.weights[name] *= ratio_var / ratio
+            else:
+                self.weights[name] *= (1. - ratio_var) / (1. - ratio)
 
     def run(self, event, t):
         """Runs the shower on a given event (= list of Particle instances),
@@ -193,9 +407,21 @@ class Shower:
         It is assumed that the first two particles in the event are the
         incoming particles.  Since this is a final-state shower only, they are
         ignored (but assumed to be present in the list).
+
+        The reweighting factors of the coupling variations of this event are
+        stored in `self.weights`.
         """
+        if self.compiled is not None:
+            self.compiled.run(event, t)
+            return
         self.current_color_index = 1
+        self.weights = {name: 1. for name in self.variations}
+        if self.stats is not None:
+            self.stats.start_event()
+            num_particles = len(event)
         # generate emissions as long as we are above the cut-off scale `t0`
         self.t = t
         while self.t > self.t0:
             self.generate_next_emission(event)
+        if self.stats is not None:
+            self.stats.end_event(len(event) - num_particles)
@@ -0,0 +1,340 @@
+"""This file implements the emission search, veto and kinematics of the
+`Shower` on array-backed events, compiled with numba. The events are stored
+as an integer array of particle ids, a (n, 4) array of momenta and a (n, 2)
+integer array of colors. If numba is not installed, `available` is False and
+the `Shower` uses its pure-Python implementation instead."""
+
+import random
+from math import pi, sqrt, log, cos, sin, frexp
+
+import numpy as np
+
+from utils.vector import Vec4
+from utils.particle import Particle
+from utils import overestimates
+from utils.alphas import AlphaS
+from utils.shower import Pqq, Pgq, Pgg, TR, CA, CF
+
+try:
+    from numba import njit
+    available = True
+except ImportError:
+    available = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# the scalar helpers shared with the Python implementation
+generate_soft_z = njit(cache=True)(overestimates.generate_soft_z)
+alphas_bin_edge = njit(cache=True)(overestimates.alphas_bin_edge)
+alphas_bin = njit(cache=True)(overestimates.alphas_bin)
+
+# kernel type codes
+PQQ = 0
+PGQ = 1
+PGG = 2
+
+# particles booked beyond the initial event size, grown if exceeded
+CAPACITY = 64
+
+@njit(cache=True)
+def alphas_value(t, params):
+    """Strong coupling at scale `t` given the `params` of an AlphaS instance,
+    see `alphas_params`."""
+    if t >= params[3]:
+        tref, asref, nf = params[1], params[2], 5.
+    elif t >= params[5]:
+        tref, asref, nf = params[3], params[4], 4.
+    else:
+        tref, asref, nf = params[5], params[6], 3.
+    b0 = (11. / 6. * CA - 2. / 3. * TR * nf) / (2. * pi)
+    if params[0] == 0:
+        return 1. / (1. / asref + b0 * log(t / tref))
+    b1 = (17. / 6. * CA * CA - (5. / 3. * CA + CF) * TR * nf) / pow(2. * pi, 2)
+    w = 1. + b0 * asref * log(t / tref)
+    return asref / w * (1. - b1 / b0 * asref * log(w) / w)
+
+@njit(cache=True)
+def kernel_value(ktype, z, y):
+    if ktype == PQQ:
+        return CF * (2. / (1. - z * (1. - y)) - (1. + z))
+    if ktype == PGQ:
+        return TR / 2. * (1. - 2. * z * (1. - z))
+    return CA / 2. * (2. / (1. - z * (1. - y)) - 2. + z * (1. - z))
+
+@njit(cache=True)
+def kernel_estimate(ktype, z):
+    if ktype == PQQ:
+        return CF * (2. / (1. - z) - 1.)
+    if ktype == PGQ:
+        return TR / 2.
+    return CA * (1. / (1. - z) - 7. / 8.)
+
+@njit(cache=True)
+def kernel_integral(ktype, zm, zp):
+    if ktype == PQQ:
+        return CF * (2. * log((1. - zm) / (1. - zp)) - (zp - zm))
+    if ktype == PGQ:
+        return TR / 2. * (zp - zm)
+    return CA * (log((1. - zm) / (1. - zp)) - 7. / 8. * (zp - zm))
+
+@njit(cache=True)
+def kernel_generate_z(ktype, zm, zp):
+    if ktype == PQQ:
+        return generate_soft_z(zm, zp, .5)
+    if ktype == PGQ:
+        return zm + (zp - zm) * random.random()
+    return generate_soft_z(zm, zp, 7. / 8.)
+
+@njit(cache=True)
+def make_kinematics(z, y, phi, mom, ij, k, new):
+    """Replaces the momenta of the splitter `ij` and the spectator `k` in
+    `mom` by those of the first daughter and the recoiling spectator, and
+    stores the second daughter at index `new`. Works on the components
+    directly, so that no temporary arrays are allocated."""
+    qE, qx, qy, qz = mom[ij, 0] + mom[k, 0], mom[ij, 1] + mom[k, 1], \
+        mom[ij, 2] + mom[k, 2], mom[ij, 3] + mom[k, 3]
+    q2 = qE * qE - qx * qx - qy * qy - qz * qz
+    rkt = sqrt(q2 * y * z * (1. - z))
+    k1x = mom[ij, 2] * mom[k, 3] - mom[ij, 3] * mom[k, 2]
+    k1y = mom[ij, 3] * mom[k, 1] - mom[ij, 1] * mom[k, 3]
+    k1z = mom[ij, 1] * mom[k, 2] - mom[ij, 2] * mom[k, 1]
+    length = sqrt(k1x * k1x + k1y * k1y + k1z * k1z)
+    if length < 1.e-6:
+        k1x, k1y, k1z = 0., mom[ij, 3], -mom[ij, 2]
+        length = sqrt(k1x * k1x + k1y * k1y + k1z * k1z)
+    f = rkt * cos(phi) / length
+    k1x, k1y, k1z = k1x * f, k1y * f, k1z * f
+    # boost pij into the rest frame of q
+    rsq = sqrt(q2)
+    v0 = (qE * mom[ij, 0] - qx * mom[ij, 1] - qy * mom[ij, 2]
+          - qz * mom[ij, 3]) / rsq
+    c1 = (mom[ij, 0] + v0) / (rsq + qE)
+    bx = mom[ij, 1] - c1 * qx
+    by = mom[ij, 2] - c1 * qy
+    bz = mom[ij, 3] - c1 * qz
+    k2x = by * k1z - bz * k1y
+    k2y = bz * k1x - bx * k1z
+    k2z = bx * k1y - by * k1x
+    f = rkt * sin(phi) / sqrt(k2x * k2x + k2y * k2y + k2z * k2z)
+    k2x, k2y, k2z = k2x * f, k2y * f, k2z * f
+    # boost kt2 back to the lab frame
+    k2E = (qx * k2x + qy * k2y + qz * k2z) / rsq
+    c1 = k2E / (rsq + qE)
+    k2x, k2y, k2z = k2x + c1 * qx, k2y + c1 * qy, k2z + c1 * qz
+    a, b = (1. - z) * y, z * y
+    mom[new, 0] = (1. - z) * mom[ij, 0] + b * mom[k, 0] - k2E
+    mom[new, 1] = (1. - z) * mom[ij, 1] + b * mom[k, 1] - k1x - k2x
+    mom[new, 2] = (1. - z) * mom[ij, 2] + b * mom[k, 2] - k1y - k2y
+    mom[new, 3] = (1. - z) * mom[ij, 3] + b * mom[k, 3] - k1z - k2z
+    mom[ij, 0] = z * mom[ij, 0] + a * mom[k, 0] + k2E
+    mom[ij, 1] = z * mom[ij, 1] + a * mom[k, 1] + k1x + k2x
+    mom[ij, 2] = z * mom[ij, 2] + a * mom[k, 2] + k1y + k2y
+    mom[ij, 3] = z * mom[ij, 3] + a * mom[k, 3] + k1z + k2z
+    for i in range(4):
+        mom[k, i] *= 1. - y
+
+@njit(cache=True)
+def make_colors(kflav, col, ij, k, new, index):
+    """Overwrites the colors of the splitter `ij` in `col` by those of the
+    first daughter and stores the colors of the second daughter at index
+    `new`, given the new color `index`."""
+    if kflav[0] != 21:
+        if kflav[0] > 0:
+            col[new, 0], col[new, 1] = col[ij, 0], index
+            col[ij, 0], col[ij, 1] = index, 0
+        else:
+            col[new, 0], col[new, 1] = index, col[ij, 1]
+            col[ij, 0], col[ij, 1] = 0, index
+    elif kflav[1] == 21:
+        if col[ij, 0] == col[k, 1] and \
+           not (col[ij, 1] == col[k, 0] and random.random() > 0.5):
+            col[new, 0], col[new, 1] = col[ij, 0], index
+            col[ij, 0] = index
+        else:
+            col[new, 0], col[new, 1] = index, col[ij, 1]
+            col[ij, 1] = index
+    elif kflav[1] > 0:
+        col[new, 0], col[new, 1] = 0, col[ij, 1]
+        col[ij, 1] = 0
+    else:
+        col[new, 0], col[new, 1] = col[ij, 0], 0
+        col[ij, 0] = 0
+
+@njit(cache=True)
+def run_event(
+    pid, mom, col, n, t, t0, seed, bins, bounds_t, bounds_as, as_params,
+    ktypes, kflavs, integrals, cells
+):
+    """Showers the array-backed event of `n` particles starting from the
+    scale `t`. Returns the number of particles afterwards, or -1 if the arrays
+    are too small to hold all emissions.
+
+    `integrals` holds the tabulated bounds of the kernel integrals divided by
+    2 pi for each kernel type, with `cells` cells per octave, see
+    `utils.sudakov.IntegralTable`."""
+    random.seed(seed)
+    color_index = 1
+    while t > t0:
+        tmax = t0
+        k = alphas_bin(t, t0, bins)
+        sel_ij, sel_k, sel_kernel, sel_m2, sel_bound, sel_bin = \
+            -1, -1, -1, 0., 0., 0
+        for ij in range(2, n):
+            for s in range(2, n):
+                if s == ij: continue
+                if not ((col[ij, 0] > 0 and col[ij, 0] == col[s, 1]) or
+                        (col[ij, 1] > 0 and col[ij, 1] == col[s, 0])):
+                    continue
+                E, px = mom[ij, 0] + mom[s, 0], mom[ij, 1] + mom[s, 1]
+                py, pz = mom[ij, 2] + mom[s, 2], mom[ij, 3] + mom[s, 3]
+                m2 = E * E - px * px - py * py - pz * pz
+                if m2 < 4. * t0: continue
+                mantissa, exponent = frexp(m2 / t0)
+                cell = (exponent - 3) * cells + \
+                    int((2. * mantissa - 1.) * cells)
+                for kernel in range(len(ktypes)):
+                    if kflavs[kernel, 0] != pid[ij]: continue
+                    if cell < integrals.shape[1]:
+                        integral = integrals[ktypes[kernel], cell]
+                    else:
+                        zp = .5 * (1. + sqrt(1. - 4. * t0 / m2))
+                        integral = kernel_integral(
+                            ktypes[kernel], 1. - zp, zp
+                        ) / (2. * pi)
+                    tt = t
+                    kk = k
+                    while True:
+                        tlow = bounds_t[kk]
+                        g = bounds_as[kk] * integral
+                        tt *= pow(random.random(), 1. / g)
+                        if tt > tlow or tlow <= tmax: break
+                        tt = tlow
+                        kk -= 1
+                    if tt > tmax:
+                        tmax = tt
+                        sel_ij, sel_k, sel_kernel = ij, s, kernel
+                        sel_m2, sel_bound, sel_bin = m2, integral, kk
+        t = tmax
+        if t <= t0:
+            break
+        ktype = ktypes[sel_kernel]
+        zp = .5 * (1. + sqrt(1. - 4. * t0 / sel_m2))
+        z = kernel_generate_z(ktype, 1. - zp, zp)
+        y = t / sel_m2 / z / (1. - z)
+        if y >= 1.:
+            continue
+        f = (1. - y) * alphas_value(t, as_params) * kernel_value(ktype, z, y)
+        g = bounds_as[sel_bin] * kernel_estimate(ktype, z)
+        g *= 2. * pi * sel_bound / kernel_integral(ktype, 1. - zp, zp)
+        if f / g <= random.random():
+            continue
+        if n == len(pid):
+            return -1
+        phi = 2. * pi * random.random()
+        make_kinematics(z, y, phi, mom, sel_ij, sel_k, n)
+        color_index += 1
+        make_colors(kflavs[sel_kernel], col, sel_ij, sel_k, n, color_index)
+        pid[n] = kflavs[sel_kernel, 2]
+        pid[sel_ij] = kflavs[sel_kernel, 1]
+        n += 1
+    return n
+
+def alphas_params(alphas):
+    """Returns the parameters of an AlphaS instance as an array to evaluate
+    the coupling in compiled code."""
+    return np.array([
+        alphas.order,
+        alphas.mz2,
+        alphas.asmz,
+        alphas.mb2,
+        alphas.asmb,
+        alphas.mc2,
+        alphas.asmc
+    ])
+
+def unsupported(shower):
+    """Returns why the compiled implementation cannot run the given shower,
+    or None if it can: numba has to be installed, the coupling has to be an
+    AlphaS instance and neither stats nor variations may be requested."""
+    if not available:
+        return "numba is not installed"
+    if type(shower.alphas) is not AlphaS:
+        return "the coupling is no AlphaS instance"
+    if shower.stats is not None:
+        return "stats are requested"
+    if shower.variations:
+        return "variations are requested"
+    return None
+
+class CompiledShower:
+    """Runs the emissions of a `Shower` in compiled code.
+
+    The particle arrays are allocated once and reused for all events, they
+    only grow if an event needs more room."""
+
+    def __init__(self, shower):
+        self.shower = shower
+        self.as_params = alphas_params(shower.alphas)
+        types = {Pqq: PQQ, Pgq: PGQ, Pgg: PGG}
+        self.ktypes = np.array([types[type(sf)] for sf in shower.kernels])
+        self.kflavs = np.array([sf.ptcl_nums for sf in shower.kernels])
+        self.integrals = np.zeros((len(types), len(shower.kernel_bounds[0])))
+        for sf, bounds in zip(shower.kernels, shower.kernel_bounds):
+            self.integrals[types[type(sf)]] = bounds
+        self.bounds_t = np.zeros(0)
+        self.bounds_as = np.zeros(0)
+        self.allocate(CAPACITY)
+
+    def allocate(self, size):
+        """(Re)allocates the particle arrays to hold `size` particles."""
+        self.pid = np.zeros(size, dtype=np.int64)
+        self.mom = np.zeros((size, 4))
+        self.col = np.zeros((size, 2), dtype=np.int64)
+
+    def run(self, event, t):
+        """Showers the event (= list of Particle instances) in-place, see
+        `Shower.run`. The compiled code is seeded from the `random` module, so
+        that seeding it makes the shower reproducible."""
+        shower = self.shower
+        shower.alphas_bin(t)
+        if len(self.bounds_t) != len(shower.alphas_bounds):
+            self.bounds_t = np.array([b[0] for b in shower.alphas_bounds])
+            self.bounds_as = np.array([b[1] for b in shower.alphas_bounds])
+        seed = random.getrandbits(32)
+
+        size = len(event)
+        if len(self.pid) < size + CAPACITY:
+            self.allocate(size + CAPACITY)
+        while True:
+            pid, mom, col = self.pid, self.mom, self.col
+            for i, p in enumerate(event):
+                pid[i] = p.pid
+                mom[i, 0], mom[i, 1] = p.mom.E, p.mom.px
+                mom[i, 2], mom[i, 3] = p.mom.py, p.mom.pz
+                col[i, 0], col[i, 1] = p.color
+            n = run_event(
+                pid, mom, col, size, t, shower.t0, seed, shower.alphas_bins,
+                self.bounds_t, self.bounds_as, self.as_params, self.ktypes,
+                self.kflavs, self.integrals, shower.integrals.cells
+            )
+            if n >= 0:
+                break
+            self.allocate(2 * len(pid))
+
+        # update the existing particles in place and append the emissions
+        for i, (pid_i, (E, px, py, pz), (c0, c1)) in enumerate(
+            zip(pid[:n].tolist(), mom[:n].tolist(), col[:n].tolist())
+        ):
+            if i < 2:
+                continue
+            if i < size:
+                p = event[i]
+                p.pid = pid_i
+                p.mom.E, p.mom.px, p.mom.py, p.mom.pz = E, px, py, pz
+                p.color[0], p.color[1] = c0, c1
+            else:
+                event.append(Particle(pid_i, Vec4(E, px, py, pz), [c0, c1]))
+        shower.t = shower.t0
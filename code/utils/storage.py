@@ -0,0 +1,310 @@
+"""This file stores showered events and array histograms in numpy archives,
+with an optional compact mode for large samples.
+
+The events are stored column-wise: the particle numbers, colours and momenta
+of all particles in flat arrays, and the offset of each event into them. In
+the compact mode, the momenta are stored as float32 in units of a float64
+scale per event, the largest energy in the event, the particle numbers as int8
+and the colours as uint16, and the archive is compressed. The compact mode
+keeps about 7 significant digits of each momentum component relative to the
+hardest particle, see `validate` for its effect on the jet resolution scales.
+
+Example usage:
+
+  save_events("events.npz", events, compact=True)
+  events = load_events("events.npz")
+
+"""
+
+import argparse
+import contextlib
+import math as m
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from utils.histogram import ArrayHistogram, ArrayHisto1D, Histo2D, Profile1D
+from utils.particle import Particle
+from utils.vector import Vec4
+
+# stored in every archive and checked by `unpack_events` and
+# `load_histograms`, so that archives of another layout, e.g. with renamed
+# arrays or other compact dtypes, are rejected instead of misread
+VERSION = 1
+COMPACT_DTYPES = {"pid": np.int8, "color": np.uint16, "momenta": np.float32}
+FULL_DTYPES = {"pid": np.int64, "color": np.int64, "momenta": np.float64}
+HISTOGRAM_TYPES = {
+    cls.__name__: cls for cls in (ArrayHisto1D, Histo2D, Profile1D)
+}
+
+@contextlib.contextmanager
+def atomic_file(file_name):
+    """Yields the name of a temporary file next to `file_name`, which replaces
+    `file_name` once the block has written it, so that readers never see a
+    partially written file. The temporary name is unique to the process and
+    keeps the extension of `file_name`, which `np.savez` would append
+    otherwise. If the block raises, the temporary file is removed and
+    `file_name` is left unchanged."""
+    root, extension = os.path.splitext(file_name)
+    temporary = "{0}.{1}.tmp{2}".format(root, os.getpid(), extension)
+    try:
+        yield temporary
+        os.replace(temporary, file_name)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+def _narrow(values, dtype, what):
+    """Returns `values` as `dtype`, raising a ValueError if they do not fit."""
+    info = np.iinfo(dtype)
+    if len(values) and (values.min() < info.min or values.max() > info.max):
+        raise ValueError(
+            "{0} exceed the range of {1} in the compact mode.".format(
+                what, np.dtype(dtype).name
+            )
+        )
+    return values.astype(dtype)
+
+def pack_events(events, compact=False):
+    """Returns the events (= lists of Particle instances) as a dictionary of
+    arrays, see the module description."""
+    dtypes = COMPACT_DTYPES if compact else FULL_DTYPES
+    offsets = np.zeros(len(events) + 1, dtype=np.int64)
+    np.cumsum([len(event) for event in events], out=offsets[1:])
+    particles = [p for event in events for p in event]
+    pid = np.array([p.pid for p in particles], dtype=np.int64)
+    color = np.array([p.color for p in particles], dtype=np.int64).reshape(-1, 2)
+    momenta = np.array(
+        [(p.mom.E, p.mom.px, p.mom.py, p.mom.pz) for p in particles],
+        dtype=np.float64
+    ).reshape(-1, 4)
+
+    arrays = {"version": VERSION, "compact": compact, "offsets": offsets}
+    if compact:
+        pid = _narrow(pid, dtypes["pid"], "Particle numbers")
+        color = _narrow(color, dtypes["color"], "Colour indices")
+        scales = np.ones(len(events))
+        if len(particles):
+            starts = offsets[:-1][offsets[1:] > offsets[:-1]]
+            nonempty = offsets[1:] > offsets[:-1]
+            scales[nonempty] = np.maximum.reduceat(
+                np.abs(momenta).max(axis=1), starts
+            )
+            scales[scales == 0.] = 1.
+            momenta = momenta / np.repeat(scales, np.diff(offsets))[:, None]
+        arrays["scales"] = scales
+    arrays["pid"] = pid
+    arrays["color"] = color
+    arrays["momenta"] = momenta.astype(dtypes["momenta"])
+    return arrays
+
+def unpack_events(arrays):
+    """Returns the events stored in `arrays`, as returned by `pack_events`, as
+    lists of Particle instances with float64 momenta."""
+    if int(arrays["version"]) != VERSION:
+        raise ValueError(
+            "Events of version {0} cannot be read, expected {1}.".format(
+                int(arrays["version"]), VERSION
+            )
+        )
+    offsets = np.asarray(arrays["offsets"])
+    momenta = np.asarray(arrays["momenta"], dtype=np.float64)
+    if bool(arrays["compact"]):
+        momenta = momenta * np.repeat(arrays["scales"], np.diff(offsets))[:, None]
+    pid = np.asarray(arrays["pid"]).tolist()
+    color = np.asarray(arrays["color"]).tolist()
+    momenta = momenta.tolist()
+    bounds = offsets.tolist()
+    return [
+        [
+            Particle(pid[i], Vec4(*momenta[i]), color[i])
+            for i in range(bounds[k], bounds[k + 1])
+        ] for k in range(len(bounds) - 1)
+    ]
+
+def save_events(file_name, events, compact=False):
+    """Writes the events (= lists of Particle instances) to the numpy archive
+    `file_name`, compressed and with reduced precision if `compact` is set."""
+    arrays = pack_events(events, compact)
+    with atomic_file(file_name) as temporary:
+        if compact:
+            np.savez_compressed(temporary, **arrays)
+        else:
+            np.savez(temporary, **arrays)
+
+def load_events(file_name):
+    """Reads the events written by `save_events`, in either mode."""
+    with np.load(file_name) as data:
+        return unpack_events(data)
+
+def save_histograms(file_name, histograms, compact=False):
+    """Writes array histograms, e.g. the Histo2D and Profile1D of an
+    `Analysis` with `correlations=True`, to the numpy archive `file_name`.
+    In the compact mode, the moments and replicas are stored as compressed
+    float32, except for the numbers of entries, which are stored as
+    integers."""
+    arrays = {"version": VERSION, "compact": compact}
+    for i, h in enumerate(histograms):
+        prefix = "h{0}_".format(i)
+        arrays[prefix + "type"] = type(h).__name__
+        arrays[prefix + "name"] = h.name
+        arrays[prefix + "scaled_by"] = h.scaled_by
+        for axis, edges in enumerate(h.edges):
+            arrays["{0}edges{1}".format(prefix, axis)] = edges
+        data = h.data
+        if compact:
+            counts = h.moments.index("numEntries")
+            arrays[prefix + "entries"] = np.rint(data[counts]).astype(np.int64)
+            data = np.delete(data, counts, axis=0).astype(np.float32)
+        arrays[prefix + "data"] = data
+        if h.replicas is not None:
+            arrays[prefix + "replicas"] = \
+                h.replicas.astype(np.float32) if compact else h.replicas
+    arrays["histograms"] = len(histograms)
+    with atomic_file(file_name) as temporary:
+        if compact:
+            np.savez_compressed(temporary, **arrays)
+        else:
+            np.savez(temporary, **arrays)
+
+def load_histograms(file_name):
+    """Reads the histograms written by `save_histograms`, in either mode."""
+    histograms = []
+    with np.load(file_name) as data:
+        if int(data["version"]) != VERSION:
+            raise ValueError(
+                "Histograms of version {0} cannot be read, expected {1}.".
+                format(int(data["version"]), VERSION)
+            )
+        compact = bool(data["compact"])
+        for i in range(int(data["histograms"])):
+            prefix = "h{0}_".format(i)
+            cls = HISTOGRAM_TYPES[str(data[prefix + "type"])]
+            h = cls.__new__(cls)
+            edges = []
+            while "{0}edges{1}".format(prefix, len(edges)) in data:
+                edges.append(data["{0}edges{1}".format(prefix, len(edges))])
+            ArrayHistogram.__init__(h, edges, str(data[prefix + "name"]))
+            h.scaled_by = float(data[prefix + "scaled_by"])
+            moments = data[prefix + "data"].astype(np.float64)
+            if compact:
+                moments = np.insert(
+                    moments,
+                    h.moments.index("numEntries"),
+                    data[prefix + "entries"],
+                    axis=0
+                )
+            h.data[:] = moments
+            if prefix + "replicas" in data:
+                h.replicas = data[prefix + "replicas"].astype(np.float64)
+            histograms.append(h)
+    return histograms
+
+def momentum_residual(event):
+    """Returns the largest component of the momentum sum of the outgoing
+    particles event[2:] minus that of the incoming particles event[:2], which
+    vanishes for exact momentum conservation, cf. `check_event`."""
+    psum = [0.] * 4
+    for i, p in enumerate(event):
+        sign = -1. if i < 2 else 1.
+        mom = p.mom
+        psum[0] += sign * mom.E
+        psum[1] += sign * mom.px
+        psum[2] += sign * mom.py
+        psum[3] += sign * mom.pz
+    return max(m.fabs(c) for c in psum)
+
+def compare_events(events, stored, cluster, tolerance=1.e-4):
+    """Compares events to the same events after storing, e.g. in the compact
+    mode, using the function `cluster` returning the splitting scales of an
+    event, like `Analysis.cluster`.
+
+    Returns a dictionary with the largest and mean relative deviation of the
+    scales, the fraction of events with a different number of scales or a
+    scale deviating by more than `tolerance`, and the largest momentum
+    residuals, see `momentum_residual`, before and after storing."""
+    deviations = []
+    deviating = 0
+    residuals = []
+    stored_residuals = []
+    for event, other in zip(events, stored):
+        scales = np.array(cluster(event))
+        other_scales = np.array(cluster(other))
+        residuals.append(momentum_residual(event))
+        stored_residuals.append(momentum_residual(other))
+        if len(scales) != len(other_scales):
+            deviating += 1
+        elif len(scales):
+            deviation = np.abs(other_scales / scales - 1.)
+            deviations.append(deviation)
+            deviating += bool(deviation.max() > tolerance)
+    deviations = np.concatenate(deviations) if deviations else np.zeros(1)
+    return {
+        "events": len(events),
+        "max_scale_deviation": float(deviations.max()),
+        "mean_scale_deviation": float(deviations.mean()),
+        "deviating_fraction": deviating / len(events) if events else 0.,
+        "max_residual": max(residuals, default=0.),
+        "max_stored_residual": max(stored_residuals, default=0.),
+    }
+
+def validate(events, cluster):
+    """Stores `events` in both modes and returns the file sizes, in bytes,
+    and the deviations of the compact mode from full precision, see
+    `compare_events`."""
+    with tempfile.TemporaryDirectory() as directory:
+        sizes = {}
+        stored = {}
+        for mode, compact in (("full", False), ("compact", True)):
+            file_name = os.path.join(directory, mode + ".npz")
+            save_events(file_name, events, compact)
+            sizes[mode] = os.path.getsize(file_name)
+            stored[mode] = load_events(file_name)
+    result = compare_events(stored["full"], stored["compact"], cluster)
+    result["bytes_full"] = sizes["full"]
+    result["bytes_compact"] = sizes["compact"]
+    result["bytes_per_event_compact"] = sizes["compact"] / max(len(events), 1)
+    result["size_ratio"] = sizes["full"] / sizes["compact"]
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Validate the compact event storage against full "
+        "precision on freshly showered events."
+    )
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--t0", type=float, default=1.)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    import random
+
+    import constants as const
+    import integrate
+    from utils.alphas import AlphaS
+    from utils.analysis import Analysis
+    from utils.shower import Shower
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    s = const.Z_MASS**2
+    shower = Shower(
+        AlphaS(const.Z_MASS**2, const.QCD_COUPLING_Z_MASS), t0=args.t0
+    )
+    events = list(
+        integrate.event_generator(
+            args.events, [[0, const.pi], [-const.pi, const.pi]], s
+        )
+    )
+    for event in events:
+        shower.run(event, s)
+    result = validate(events, Analysis().cluster)
+    width = max(len(key) for key in result)
+    for key, value in result.items():
+        print("{0:<{1}} {2:.6g}".format(key, width, value))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""This file tabulates the overestimate integrals of the splitting kernels,
+which enter the Sudakov form factors of the trial emissions, as a function of
+the dipole mass, so that the emission search does not have to evaluate them
+for every dipole and kernel."""
+
+import hashlib
+import math as m
+import os
+
+import numpy as np
+
+from utils.storage import atomic_file
+
+# enters the key of the cached tables, so that tables of a previous
+# tabulation, e.g. with other bounds per cell, are recomputed instead of
+# loaded from the cache directory
+VERSION = 1
+
+class IntegralTable:
+    """Upper bounds of `kernel.Integral(1 - zp, zp)` with
+    zp = (1 + sqrt(1 - 4 * t0 / m2)) / 2 for dipole masses m2 >= 4 * t0.
+
+    The range of x = m2 / t0 is divided into `cells` cells per octave,
+    starting at x = 4, over `octaves` octaves. Beyond that, the analytic
+    integrals lose precision anyway, since 1 - zp approaches t0 / m2. Each
+    cell stores the integral at its upper edge, which bounds the integral
+    within the cell from above, since the integral grows monotonically with
+    m2. Interpolating linearly instead would underestimate the concave
+    integral and break the veto algorithm. The cell of a mass is found with
+    `frexp` only, without evaluating transcendental functions.
+
+    Example usage, looking up the bound of the first kernel of a shower:
+
+      table = IntegralTable.cached(shower.kernels, shower.t0, "cache")
+      bound = table.lookup(shower.kernels[0], m2)
+
+    """
+
+    def __init__(self, kernels, t0, cells=64, octaves=32, values=None):
+        """Tabulates the integrals of one instance of each kernel class in
+        `kernels` for the cut-off `t0`, unless the tables are passed as
+        `values`, a dictionary mapping the kernel classes to arrays."""
+        self.t0 = t0
+        self.cells = cells
+        self.octaves = octaves
+        self.kernels = {}
+        for sf in kernels:
+            self.kernels.setdefault(type(sf), sf)
+        if values is None:
+            upper = self.upper_edges()
+            values = {
+                kernel_type: self.integral(sf, upper)
+                for kernel_type, sf in self.kernels.items()
+            }
+        self.arrays = values
+        # lists are faster to index from Python than arrays
+        self.values = {
+            kernel_type: array.tolist() for kernel_type, array in values.items()
+        }
+
+    def key(self):
+        """Returns a hash of everything the tables depend on."""
+        names = sorted(k.__module__ + "." + k.__name__ for k in self.kernels)
+        return hashlib.sha1(
+            repr((VERSION, float(self.t0), names, self.cells, self.octaves)).
+            encode()
+        ).hexdigest()[:16]
+
+    def upper_edges(self):
+        """Returns the upper edges of all cells in x = m2 / t0."""
+        k = np.arange(self.cells * self.octaves)
+        octave, cell = np.divmod(k, self.cells)
+        return 4. * np.exp2(octave) * (1. + (cell + 1.) / self.cells)
+
+    def integral(self, sf, x):
+        """The analytic integral of `sf` at x = m2 / t0, which may be an
+        array."""
+        zp = .5 * (1. + np.sqrt(1. - 4. / x))
+        return sf.Integral(1. - zp, zp)
+
+    def cell(self, m2):
+        """Returns the index of the cell containing the mass `m2` >= 4 * t0,
+        which exceeds the table if m2 is out of range."""
+        mantissa, exponent = m.frexp(m2 / self.t0)
+        return (exponent - 3) * self.cells + \
+            int((2. * mantissa - 1.) * self.cells)
+
+    def lookup(self, sf, m2):
+        """Returns the upper bound of the integral of the kernel `sf` at the
+        mass `m2` >= 4 * t0, or the analytic integral if m2 is out of
+        range."""
+        values = self.values[type(sf)]
+        cell = self.cell(m2)
+        if cell < len(values):
+            return values[cell]
+        return float(self.integral(sf, m2 / self.t0))
+
+    def validate(self, samples=8):
+        """Compares the tables to the analytic integrals at `samples` points
+        within each cell, including its edges. Raises a ValueError if a table
+        does not bound an integral from above.
+
+        Returns for each kernel class name an array of the maximum relative
+        excess of the table over the analytic integral in each octave, i.e.
+        the largest fraction of trial emissions spent on the looser bound. It
+        is largest in the first octave, where the integrals rise like
+        sqrt(m2 - 4 * t0)."""
+        upper = self.upper_edges()
+        lower = np.concatenate([[4.], upper[:-1]])
+        excess = {}
+        for kernel_type, sf in self.kernels.items():
+            table = self.arrays[kernel_type]
+            if len(table) != len(upper):
+                raise ValueError("Table of {0} has the wrong size.".format(
+                    kernel_type.__name__
+                ))
+            worst = np.zeros(len(table))
+            for i in range(samples + 1):
+                x = lower + (upper - lower) * i / samples
+                exact = self.integral(sf, x)
+                if np.any(table < exact * (1. - 1.e-12)):
+                    raise ValueError(
+                        "Table of {0} underestimates the integral.".format(
+                            kernel_type.__name__
+                        )
+                    )
+                positive = exact > 0.
+                worst[positive] = np.maximum(
+                    worst[positive], table[positive] / exact[positive] - 1.
+                )
+            excess[kernel_type.__name__] = \
+                worst.reshape(self.octaves, self.cells).max(axis=1)
+        return excess
+
+    def save(self, file_name):
+        np.savez(
+            file_name,
+            key=self.key(),
+            t0=self.t0,
+            cells=self.cells,
+            octaves=self.octaves,
+            **{k.__name__: a for k, a in self.arrays.items()}
+        )
+
+    @classmethod
+    def load(cls, file_name, kernels, t0, cells=64, octaves=32):
+        """Loads the tables for the given settings from `file_name` and
+        validates them. Raises a ValueError if the file holds tables of other
+        settings or tables that fail the validation."""
+        table = cls(kernels, t0, cells, octaves, values={})
+        with np.load(file_name) as data:
+            if str(data["key"]) != table.key():
+                raise ValueError(
+                    "{0} holds tables of other settings.".format(file_name)
+                )
+            values = {k: data[k.__name__] for k in table.kernels}
+        table = cls(kernels, t0, cells, octaves, values)
+        table.validate(samples=1)
+        return table
+
+    @classmethod
+    def cached(cls, kernels, t0, directory, cells=64, octaves=32):
+        """Returns the tables for the given settings from `directory`. If
+        they have not been stored there yet or cannot be loaded, they are
+        tabulated, validated and stored."""
+        table = cls(kernels, t0, cells, octaves, values={})
+        file_name = os.path.join(
+            directory, "integrals_{0}.npz".format(table.key())
+        )
+        try:
+            return cls.load(file_name, kernels, t0, cells, octaves)
+        except (OSError, KeyError, ValueError):
+            pass
+        table = cls(kernels, t0, cells, octaves)
+        table.validate()
+        os.makedirs(directory, exist_ok=True)
+        # concurrent runs must never load a partially written table
+        with atomic_file(file_name) as temporary:
+            table.save(temporary)
+        return table
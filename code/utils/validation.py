@@ -0,0 +1,179 @@
+"""This file compares histograms of YODA files statistically, to validate that
+changes to the shower or the analysis leave the distributions intact."""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+import numpy as np
+
+from utils.yoda import data_objects
+
+REFERENCE = os.path.join(
+    os.path.dirname(__file__), "..", "..", "data", "shower_reference.yoda"
+)
+
+def compare_histogram(bins, reference_bins, normalize=True):
+    """Compares two histograms given as lists of [xlow, xhigh, sumw, sumw2]
+    bins, as returned by `data_objects`. With `normalize`, both histograms
+    are scaled to unit area first, so that only their shapes are compared.
+
+    The variance of each bin is taken from the stored sumw2, but not below the
+    variance expected from the pooled shape of both histograms. Otherwise
+    sparsely filled bins of a reduced sample, which are empty by chance, get
+    a vanishing uncertainty.
+
+    Returns a dictionary holding the chi2, the number of degrees of freedom
+    (the number of bins with non-vanishing uncertainty) and the pulls of all
+    bins, which are 0 for bins without uncertainty."""
+    bins = np.array(bins)
+    reference_bins = np.array(reference_bins)
+    if bins.shape != reference_bins.shape or \
+       not np.allclose(bins[:, :2], reference_bins[:, :2]):
+        raise ValueError("Histograms have different binnings.")
+
+    sumw, sumw2 = bins[:, 2], bins[:, 3]
+    ref_sumw, ref_sumw2 = reference_bins[:, 2], reference_bins[:, 3]
+    area, ref_area = np.sum(sumw), np.sum(ref_sumw)
+
+    # pool the shapes weighted by the effective number of entries
+    n_eff = area**2 / np.sum(sumw2)
+    ref_n_eff = ref_area**2 / np.sum(ref_sumw2)
+    shape = (n_eff * sumw / area + ref_n_eff * ref_sumw / ref_area) / \
+        (n_eff + ref_n_eff)
+    var = np.maximum(sumw2, shape * np.sum(sumw2))
+    ref_var = np.maximum(ref_sumw2, shape * np.sum(ref_sumw2))
+
+    if normalize:
+        sumw, var = sumw / area, var / area**2
+        ref_sumw, ref_var = ref_sumw / ref_area, ref_var / ref_area**2
+
+    sigma = np.sqrt(var + ref_var)
+    filled = sigma > 0
+    pulls = np.zeros_like(sigma)
+    pulls[filled] = (sumw[filled] - ref_sumw[filled]) / sigma[filled]
+    chi2 = float(np.sum(pulls**2))
+    ndf = int(np.sum(filled))
+    return {
+        "chi2": chi2,
+        "ndf": ndf,
+        "chi2_ndf": chi2 / ndf if ndf else 0.,
+        "pulls": pulls,
+    }
+
+def compare_files(file_name, reference, tolerance=1.5, normalize=True):
+    """Compares all histograms of the YODA file `file_name` to those of the
+    same name in `reference`. A histogram passes, if its chi2/ndf does not
+    exceed `tolerance`.
+
+    Returns whether all histograms passed and a dictionary mapping the
+    histogram names to the results of `compare_histogram`."""
+    names, histos = data_objects([file_name, reference], yodatype="HISTO1D")
+    results = {}
+    for name in names:
+        if name not in histos[file_name] or name not in histos[reference]:
+            raise ValueError("Histogram {0} is missing.".format(name))
+        results[name] = compare_histogram(
+            histos[file_name][name]["bins"],
+            histos[reference][name]["bins"],
+            normalize
+        )
+        results[name]["passed"] = results[name]["chi2_ndf"] <= tolerance
+    return all(r["passed"] for r in results.values()), results
+
+def generate_sample(file_name, events=2000, seed=42, t0=1.):
+    """Showers and analyzes a fixed-seed sample of `events` e+e- -> qq events
+    at the Z pole and writes the histograms to the YODA file `file_name`."""
+    import constants as const
+    import integrate
+    from utils.alphas import AlphaS
+    from utils.analysis import Analysis
+    from utils.shower import Shower
+
+    random.seed(seed)
+    np.random.seed(seed)
+    s = const.Z_MASS**2
+    interval = [[0, np.pi], [-np.pi, np.pi]]
+    shower = Shower(AlphaS(const.Z_MASS**2, const.QCD_COUPLING_Z_MASS), t0=t0)
+    analysis = Analysis()
+    for event in integrate.event_generator(events, interval, s):
+        shower.run(event, s)
+        analysis.analyze(event, 1.)
+    analysis.finalize(file_name)
+
+def check_shower(
+    reference=REFERENCE, events=2000, seed=42, t0=1., tolerance=1.5
+):
+    """Generates a reduced fixed-seed sample with the current shower and
+    analysis and compares it to the `reference` YODA file, see
+    `compare_files`."""
+    with tempfile.NamedTemporaryFile(suffix=".yoda") as file:
+        generate_sample(file.name, events, seed, t0)
+        return compare_files(file.name, reference, tolerance)
+
+def print_results(results):
+    for name, result in results.items():
+        print(
+            "{0:<32} chi2/ndf = {1:7.3f} / {2:<3} = {3:6.3f}  "
+            "max |pull| = {4:5.2f}  {5}".format(
+                name,
+                result["chi2"],
+                result["ndf"],
+                result["chi2_ndf"],
+                np.max(np.abs(result["pulls"])),
+                "ok" if result["passed"] else "FAILED"
+            )
+        )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare YODA histograms to a reference."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compare = commands.add_parser(
+        "compare", help="compare a produced YODA file to a reference"
+    )
+    compare.add_argument("file_name")
+    compare.add_argument("reference")
+    compare.add_argument(
+        "--no-normalize",
+        action="store_true",
+        help="compare absolute instead of unit-area histograms"
+    )
+
+    check = commands.add_parser(
+        "check", help="run a fixed-seed sample and compare it to a reference"
+    )
+    check.add_argument("--reference", default=REFERENCE)
+    check.add_argument("--events", type=int, default=2000)
+    check.add_argument("--seed", type=int, default=42)
+    check.add_argument("--t0", type=float, default=1.)
+
+    for command in (compare, check):
+        command.add_argument(
+            "--tolerance",
+            type=float,
+            default=1.5,
+            help="maximum chi2/ndf per histogram"
+        )
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        passed, results = compare_files(
+            args.file_name,
+            args.reference,
+            args.tolerance,
+            not args.no_normalize
+        )
+    else:
+        passed, results = check_shower(
+            args.reference, args.events, args.seed, args.t0, args.tolerance
+        )
+    print_results(results)
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,8 @@
-import matplotlib.pyplot as plt
+import argparse
+import concurrent.futures
+import os
+import sys
+
 import numpy as np
 
 lw = 1.0
@@ -47,6 +51,93 @@ def data_objects(filenames, yodatype="HISTO1D"):
     return sorted(names), objects
 
 
+def histogram_arrays(filenames, yodatype="HISTO1D"):
+    """Like `data_objects`, but returns the bins of each object as a
+    (bins, 4) array of [xlow, xhigh, sumw, sumw2] rows."""
+    names, objects = data_objects(filenames, yodatype)
+    arrays = {
+        filename: {
+            name: np.array(obj["bins"]).reshape(-1, 4)
+            for name, obj in file_objects.items()
+        } for filename, file_objects in objects.items()
+    }
+    return names, arrays
+
+
+def compare_arrays(histo, reference):
+    """Returns the bin edges, the differential cross section and its error of
+    the (bins, 4) array `histo` and its deviation from `reference` in units of
+    the reference uncertainty, with the error of that deviation."""
+    x = np.append(histo[:, 0], histo[:, 1][-1])
+    widths = histo[:, 1] - histo[:, 0]
+    y = histo[:, 2] / widths
+    yerr = np.sqrt(histo[:, 3]) / widths
+    sigma = np.sqrt(reference[:, 3]) / widths
+    pulls = (y - reference[:, 2] / widths) / sigma
+    return x, y, yerr, pulls, yerr / sigma
+
+
+def draw_jet_histograms(fig, filenames, histonames, histos):
+    """Draws the jet rate histograms `histos`, as returned by
+    `histogram_arrays` for `filenames`, and their deviations from the first
+    file into the figure `fig`, see `plot_jet_histograms`."""
+    axes = np.array(fig.subplots(nrows=len(histonames), ncols=2)).reshape(-1, 2)
+    main_axes = axes[:,0]
+    ratio_axes = axes[:,1]
+    for histoname, (main_ax, ratio_ax) in zip(histonames, zip(main_axes, ratio_axes)):
+        central_histo = histos[filenames[0]].get(histoname)
+
+        for (file, file_histos), color in zip(histos.items(), colors):
+            histo = file_histos.get(histoname)
+            if histo is None:
+                continue
+
+            x, y, yerr, pulls, pull_errors = compare_arrays(
+                histo, histo if central_histo is None else central_histo
+            )
+            centers = 0.5 * (x[:-1] + x[1:])
+
+            main_ax.step(x, np.append(y, y[-1]), where="post", linewidth=1.0, label=file, color=color)
+            main_ax.bar(centers, y, yerr=yerr, alpha=0.0, linewidth=lw, ecolor=color)
+
+            if histo is central_histo:
+                ratio_ax.step(x, [0]*len(x), color=color)
+                ratio_ax.fill_between(x, [-1]*len(x), [1]*len(x), color='yellow', alpha=0.5)
+            elif central_histo is not None:
+                ratio_ax.step(x, np.append(pulls, pulls[-1]), where="post", linewidth=lw, color=color)
+                error_kw = {"elinewidth": lw}
+                ratio_ax.bar(centers, pulls, yerr=pull_errors, alpha=0.0, ecolor=color, error_kw=error_kw)
+
+        main_ax.set_yscale('log')
+        njet = int(histoname[-2])
+        main_ax.set_title(
+                r"Differential ${}\to {}$ jet resolution".format(njet, njet+1))
+        jets = "{}{}".format(njet, njet+1)
+        main_ax.set_xlabel("$\log_{10}(y_{" + jets + r"})$")
+        main_ax.set_ylabel(r"$\mathrm{d}\sigma/\mathrm{d}\log_{10}(y_{" + jets + r"})$ [pb]")
+        ratio_ax.set_ylim(-5, 5)
+        ratio_ax.set_ylabel("standard deviation")
+
+        xlim = None
+        if "y_23" in histoname:
+            xlim = (-4, -0.4)
+            main_ax.set_ylim(4e2, 4e4)
+            main_ax.legend()
+        elif "y_34" in histoname:
+            xlim = (-4, -0.8)
+            main_ax.set_ylim(8e-1, 8e4)
+        elif "y_45" in histoname:
+            xlim = (-4, -1.2)
+            main_ax.set_ylim(8e-1, 8e4)
+        elif "y_56" in histoname:
+            xlim = (-4, -1.6)
+            main_ax.set_ylim(8e-2, 8e4)
+        main_ax.set_xlim(xlim)
+        ratio_ax.set_xlim(xlim)
+
+    fig.tight_layout()
+
+
 def plot_jet_histograms(filenames):
     """Plots jet rate histograms from YODA files. Pass a list of filenames to
     read histograms from. The first one is considered to be the reference
@@ -54,6 +145,7 @@ def plot_jet_histograms(filenames):
     purpose, not only a nominal plot is drawn, but also a deviation plot, which
     indicates how many sigma are given bin deviates from the reference.
     """
+    import matplotlib.pyplot as plt
 
     print("Plotting (might take a few moments) ...")
 
@@ -61,18 +153,16 @@ def plot_jet_histograms(filenames):
         # There might be unfilled bins, therefore ignore numpy divide-by-0 errors,
         # cf. https://stackoverflow.com/questions/29950557/ignore-divide-by-0-warning-in-numpy
 
-        histonames, histos = data_objects(filenames, yodatype="HISTO1D")
-        
+        histonames, histos = histogram_arrays(filenames, yodatype="HISTO1D")
+
         if single_plot:
             fig, ax = plt.subplots()
-            sums = np.zeros(len(histos[filenames[0]][histonames[0]]["bins"]))
-            sums2 = sums.copy()
-            for i in range(len(sums)):
-                sums[i]  += sum([histos[filenames[0]][n]["bins"][i][2] for n in histonames])
-                sums2[i] += sum([histos[filenames[0]][n]["bins"][i][3] for n in histonames])
+            reference = histos[filenames[0]]
+            sums = np.sum([reference[n][:,2] for n in histonames], axis=0)
+            sums2 = np.sum([reference[n][:,3] for n in histonames], axis=0)
             for histoname in histonames:
-                histo = np.array(histos[filenames[0]][histoname]["bins"])
-                
+                histo = reference[histoname]
+
                 x = np.append(histo[:,0], histo[:,1][-1])
                 widths = histo[:,1] - histo[:,0]
                 centers = 0.5 * (x[:-1] + x[1:])
@@ -83,90 +173,22 @@ def plot_jet_histograms(filenames):
                 ax.step(x, np.append(y, y[-1]), where="post", linewidth=1.0, label=r"{}-rate".format(njets))
                 ax.bar(centers, y, yerr=yerr, alpha=0.0, linewidth=lw)
             ax.legend()
-                
+
         else:
-            fig, axes = plt.subplots(nrows=len(histonames), ncols=2, figsize=[12,15])
-            axes = np.array(axes)
-            main_axes = axes[:,0]
-            ratio_axes = axes[:,1]
-            for histoname, (main_ax, ratio_ax) in zip(histonames, zip(main_axes, ratio_axes)):
-                try:
-                    raw_central_histo = histos[filenames[0]][histoname]["bins"]
-                    central_histo = np.array(raw_central_histo)
-                except KeyError:
-                    raw_central_histo = None
-                    central_histo = None
-
-                for (file, file_histos), color in zip(histos.items(), colors):
-                    try:
-                        raw_histo = file_histos[histoname]["bins"]
-                        histo = np.array(raw_histo)
-                    except KeyError:
-                        continue
-
-                    x = np.append(histo[:,0], histo[:,1][-1])
-                    widths = histo[:,1] - histo[:,0]
-                    centers = 0.5 * (x[:-1] + x[1:])
-                    y = histo[:,2] / widths
-                    yerr = np.sqrt(histo[:,3]) / widths
-
-                    main_ax.step(x, np.append(y, y[-1]), where="post", linewidth=1.0, label=file, color=color)
-                    main_ax.bar(centers, y, yerr=yerr, alpha=0.0, linewidth=lw, ecolor=color)
-
-                    if raw_histo is raw_central_histo:
-                        ratio_ax.step(x, [0]*len(x), color=color)
-                        ratio_ax.fill_between(x, [-1]*len(x), [1]*len(x), color='yellow', alpha=0.5)
-                    elif central_histo is not None:
-                        y = (y - central_histo[:,2] / widths) / (np.sqrt(central_histo[:,3])/widths)
-                        yerr /= np.sqrt(central_histo[:,3]) / widths
-                        ratio_ax.step(x, np.append(y, y[-1]), where="post", linewidth=lw, color=color)
-                        error_kw = {"elinewidth": lw}
-                        ratio_ax.bar(centers, y, yerr=yerr, alpha=0.0, ecolor=color, error_kw=error_kw)
-
-                main_ax.set_yscale('log')
-                njet = int(histoname[-2])
-                main_ax.set_title(
-                        r"Differential ${}\to {}$ jet resolution".format(njet, njet+1))
-                jets = "{}{}".format(njet, njet+1)
-                main_ax.set_xlabel("$\log_{10}(y_{" + jets + r"})$")
-                main_ax.set_ylabel(r"$\mathrm{d}\sigma/\mathrm{d}\log_{10}(y_{" + jets + r"})$ [pb]")
-                ratio_ax.set_ylim(-5, 5)
-                ratio_ax.set_ylabel("standard deviation")
-
-                xlim = None
-                if "y_23" in histoname:
-                    xlim = (-4, -0.4)
-                    main_ax.set_ylim(4e2, 4e4)
-                    main_ax.legend()
-                elif "y_34" in histoname:
-                    xlim = (-4, -0.8)
-                    main_ax.set_ylim(8e-1, 8e4)
-                elif "y_45" in histoname:
-                    xlim = (-4, -1.2)
-                    main_ax.set_ylim(8e-1, 8e4)
-                elif "y_56" in histoname:
-                    xlim = (-4, -1.6)
-                    main_ax.set_ylim(8e-2, 8e4)
-                main_ax.set_xlim(xlim)
-                ratio_ax.set_xlim(xlim)
-
-            fig.tight_layout()
+            fig = plt.figure(figsize=[12,15])
+            draw_jet_histograms(fig, filenames, histonames, histos)
 
 
-def plot_scatters(filenames):
-    histonames, histos = data_objects(filenames, yodatype="SCATTER2D")
-    
-    fig, ax = plt.subplots()
-    
-    sums = np.zeros(len(histos[filenames[0]][histonames[0]]["bins"]))
-    for i in range(len(sums)):
-        sums[i] += sum([histos[filenames[0]][n]["bins"][i][2] for n in histonames])
-        
+def draw_scatters(ax, filename, histonames, histos):
+    """Draws the relative n-jet rates of the scatters `histos` of `filename`,
+    as returned by `histogram_arrays`, into the axes `ax`."""
+    reference = histos[filename]
+    sums = np.sum([reference[n][:,2] for n in histonames], axis=0)
+
     for histoname in histonames:
-        histo = np.array(histos[filenames[0]][histoname]["bins"])
+        histo = reference[histoname]
 
         x = np.append(histo[:,0], histo[:,1][-1])
-        widths = histo[:,1] - histo[:,0]
         y = histo[:,2] / sums
 
         njets = int(histoname[-1])
@@ -174,3 +196,88 @@ def plot_scatters(filenames):
     ax.legend()
     ax.set_ylabel("relative n-jet event rates")
     ax.set_xlabel("$\log_{10}(y_\mathrm{cut})$")
+
+
+def plot_scatters(filenames):
+    import matplotlib.pyplot as plt
+    histonames, histos = histogram_arrays(filenames, yodatype="SCATTER2D")
+
+    fig, ax = plt.subplots()
+    draw_scatters(ax, filenames[0], histonames, histos)
+
+
+def render_comparison(filenames, output):
+    """Renders the jet rate histograms of `filenames` compared to the first
+    one, see `plot_jet_histograms`, and the n-jet rates of the last one to
+    the image file `output`. The figure is drawn by the non-interactive Agg
+    backend without touching the pyplot state, so that it can run in batch
+    jobs and worker processes. Returns `output`."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        histonames, histos = histogram_arrays(filenames, yodatype="HISTO1D")
+        fig = Figure(figsize=[12,15])
+        FigureCanvasAgg(fig)
+        draw_jet_histograms(fig, filenames, histonames, histos)
+        fig.savefig(output)
+
+        names, scatters = histogram_arrays(filenames[-1:], yodatype="SCATTER2D")
+        if names:
+            fig = Figure()
+            FigureCanvasAgg(fig)
+            draw_scatters(fig.subplots(), filenames[-1], names, scatters)
+            root, ext = os.path.splitext(output)
+            fig.savefig("{0}_rates{1}".format(root, ext))
+    return output
+
+
+def render_batch(reference, filenames, output_dir, workers=None, ext=".png"):
+    """Renders the comparison of each file in `filenames` to the `reference`
+    file, see `render_comparison`, into `output_dir`, named after the
+    compared file. The comparisons are rendered in parallel by `workers`
+    processes, by default one per CPU.
+
+    Returns the list of written files in the order of `filenames`."""
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = [
+        os.path.join(
+            output_dir, os.path.splitext(os.path.basename(f))[0] + ext
+        ) for f in filenames
+    ]
+    if len(set(outputs)) < len(outputs):
+        raise ValueError("Compared files need distinct base names.")
+    if workers == 1:
+        return [
+            render_comparison([reference, f], o)
+            for f, o in zip(filenames, outputs)
+        ]
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(
+            render_comparison, [[reference, f] for f in filenames], outputs
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Render comparisons of YODA files to a reference."
+    )
+    parser.add_argument("reference")
+    parser.add_argument("filenames", nargs="+")
+    parser.add_argument("-o", "--output-dir", default="plots")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--format", default="png")
+    args = parser.parse_args(argv)
+    for output in render_batch(
+        args.reference,
+        args.filenames,
+        args.output_dir,
+        args.workers,
+        "." + args.format
+    ):
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())